@@ -4,11 +4,22 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import unidecode 
 import gspread # Necesario para la conexión directa
 import json # Necesario para procesar el JSON de secrets
+import os
+import sys
+import time
+import sqlite3 # Cache local persistente de las hojas
+import threading
+import heapq
+import random
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 from oauth2client.service_account import ServiceAccountCredentials # Necesario para credenciales
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
@@ -36,6 +47,147 @@ VENTAS_COLS = [
     'GASTOS_DIRECTOS_VIAJE', 'GANANCIA_NETA', 'VENDEDOR_REGISTRA'
 ]
 
+# Tipo de cada columna en memoria (ver aplicar_esquema): 'texto', 'categoria' (pocos valores que se repiten),
+# 'cantidad' (unidades enteras), 'dinero' (entero en centavos) o 'fecha'
+ESQUEMA_INVENTARIO = {
+    'ID_PRODUCTO': 'texto', 'CODIGO_SKU': 'texto', 'NOMBRE_PRODUCTO': 'texto', 'CANTIDAD_ACTUAL': 'cantidad',
+    'COSTO_UNITARIO': 'dinero', 'PRECIO_BASE': 'dinero', 'PRECIO_PUBLICO': 'dinero', 'UBICACION_FISICA': 'categoria'
+}
+ESQUEMA_VENTAS = {
+    # En Ventas el producto se repite en muchas filas: se guarda una vez por producto y un código por venta
+    'ID_VENTA': 'texto', 'FECHA_HORA': 'fecha', 'CODIGO_SKU_VENDIDO': 'categoria', 'NOMBRE_PRODUCTO_VENDIDO': 'categoria',
+    'CANTIDAD_UNIDADES': 'cantidad', 'TIPO_CLIENTE': 'categoria', 'PRECIO_VENTA_FINAL': 'dinero',
+    'COSTO_DEL_PRODUCTO_TOTAL': 'dinero', 'GASTOS_DIRECTOS_VIAJE': 'dinero', 'GANANCIA_NETA': 'dinero',
+    'VENDEDOR_REGISTRA': 'categoria'
+}
+
+# Formato con que se escribe FECHA_HORA en la hoja (y con que se lee)
+FORMATO_FECHA_HORA = '%Y-%m-%d %H:%M:%S'
+
+# Resumen de ventas para los reportes: totales por cada combinación de estas claves ('DIA' = 'YYYY-MM-DD')
+RESUMEN_CLAVES = ['DIA', 'NOMBRE_PRODUCTO_VENDIDO', 'VENDEDOR_REGISTRA', 'TIPO_CLIENTE']
+RESUMEN_TOTALES = ['VENTAS', 'CANTIDAD_UNIDADES', 'PRECIO_VENTA_FINAL', 'COSTO_DEL_PRODUCTO_TOTAL', 'GASTOS_DIRECTOS_VIAJE', 'GANANCIA_NETA']
+
+# Columna clave de cada hoja para comparar filas al sincronizar
+CLAVES_HOJA = {
+    INVENTARIO_SHEET_NAME: 'ID_PRODUCTO',
+    VENTAS_SHEET_NAME: 'ID_VENTA'
+}
+
+# Si el cambio supera esta fracción de las celdas de la hoja, se reescribe completa
+UMBRAL_REESCRITURA = 0.5
+
+# Máximo de resultados de búsqueda que se muestran (Registro Rápido / Gestión de Inventario)
+LIMITE_SUGERENCIAS = 50
+LIMITE_RESULTADOS_INVENTARIO = 500
+# Búsqueda aproximada (con errores de tipeo): fracción mínima de trigramas de la búsqueda que debe tener el producto
+SIMILITUD_MINIMA = 0.5
+
+# Intentos de guardado cuando otro vendedor escribió en la hoja al mismo tiempo
+REINTENTOS_CONFLICTO = 4
+
+# Hoja auxiliar cuya celda A1 es el cerrojo de las escrituras de stock (ver tomar_cerrojo); no se descarga
+CERROJO_SHEET_NAME = 'Cerrojo'
+# Segundos que se espera tras escribir el cerrojo: más de lo que tarda cualquier vendedor entre leerlo libre y escribirlo
+ESPERA_CERROJO = 2
+# Segundos que un cerrojo puede seguir con el mismo dueño antes de darlo por abandonado (ej: un equipo que se apagó)
+VENCIMIENTO_CERROJO = 30
+
+# Copia local de las hojas (SQLite): sobrevive a los reinicios de Streamlit
+CACHE_LOCAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache_local.sqlite')
+# Versión del formato de las copias guardadas; al cambiarla, las copias viejas se descartan y se vuelven a bajar
+FORMATO_CACHE_LOCAL = 2
+# Antigüedad a partir de la cual se consulta (en segundo plano) si la hoja cambió
+REFRESCO_SEGUNDOS = 10
+
+# Cola de escritura: cambios pendientes que se envían por lote y en segundo plano
+LOTE_MAXIMO_COLA = 200
+REVISION_COLA_SEGUNDOS = 30
+# Espera máxima entre reintentos de envío (crece al doble en cada fallo)
+ESPERA_MAXIMA_SEGUNDOS = 300
+
+# Sin conexión: tiempo de espera de la red (conexión, lectura) y pausa antes de volver a intentar conectar
+TIEMPO_ESPERA_RED = (5, 30)
+REINTENTO_CONEXION_SEGUNDOS = 30
+# Tiempo máximo para bajar cada hoja cuando se leen por separado (en paralelo)
+TIEMPO_MAXIMO_LECTURA = 60
+
+# Cuota de la API de Google Sheets por usuario (llamadas por minuto) y reintentos ante el error 429
+CUOTA_POR_MINUTO = {'lectura': 60, 'escritura': 60}
+REINTENTOS_429 = 3
+# Por debajo de esta fracción de cuota de lectura libre no se refresca la copia local en segundo plano
+CUOTA_MINIMA_REFRESCO = 0.25
+
+# --- CUOTA DE LA API ---
+
+@st.cache_resource
+def _cuota_api():
+    """Fichas de lectura y escritura disponibles y registro de llamadas (compartido por todas las sesiones)."""
+    return {
+        'lock': threading.Lock(),
+        'fichas': {tipo: float(limite) for tipo, limite in CUOTA_POR_MINUTO.items()},
+        'recarga': time.time(),
+        'llamadas': {'lectura': deque(), 'escritura': deque(), 'rechazos': deque()}
+    }
+
+def _recargar_fichas(cuota, ahora):
+    """Cubeta de fichas: cada tipo recupera su cuota por minuto de forma continua, sin pasar del máximo."""
+    for tipo, limite in CUOTA_POR_MINUTO.items():
+        cuota['fichas'][tipo] = min(limite, cuota['fichas'][tipo] + (ahora - cuota['recarga']) * limite / 60)
+    cuota['recarga'] = ahora
+
+def tomar_ficha(tipo):
+    """Espera (si hace falta) a que haya cuota para una llamada de 'lectura' o 'escritura' y la descuenta."""
+    cuota = _cuota_api()
+    while True:
+        with cuota['lock']:
+            ahora = time.time()
+            _recargar_fichas(cuota, ahora)
+            if cuota['fichas'][tipo] >= 1:
+                cuota['fichas'][tipo] -= 1
+                cuota['llamadas'][tipo].append(ahora)
+                return
+            espera = (1 - cuota['fichas'][tipo]) * 60 / CUOTA_POR_MINUTO[tipo]
+        time.sleep(espera)
+
+def cuota_disponible(tipo):
+    """Fracción de la cuota por minuto de un tipo que está libre ahora (1 = sin uso reciente)."""
+    cuota = _cuota_api()
+    with cuota['lock']:
+        _recargar_fichas(cuota, time.time())
+        return cuota['fichas'][tipo] / CUOTA_POR_MINUTO[tipo]
+
+def uso_api():
+    """Llamadas a la API en el último minuto: {'lectura': n, 'escritura': n, 'rechazos': n (errores 429)}."""
+    cuota = _cuota_api()
+    limite = time.time() - 60
+    with cuota['lock']:
+        for llamadas in cuota['llamadas'].values():
+            while llamadas and llamadas[0] < limite:
+                llamadas.popleft()
+        return {tipo: len(llamadas) for tipo, llamadas in cuota['llamadas'].items()}
+
+class ClienteHttpConCuota(gspread.http_client.HTTPClient):
+    """
+    Cliente HTTP de gspread que respeta la cuota por minuto: cada llamada toma una ficha de lectura (GET)
+    o de escritura (el resto) y espera si no hay. Ante un 429 vacía esa cubeta y reintenta con espera creciente.
+    """
+    def request(self, method, endpoint, *args, **kwargs):
+        tipo = 'lectura' if method.upper() == 'GET' else 'escritura'
+        for intento in range(REINTENTOS_429 + 1):
+            tomar_ficha(tipo)
+            try:
+                return super().request(method, endpoint, *args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if e.code != 429 or intento == REINTENTOS_429:
+                    raise
+                cuota = _cuota_api()
+                with cuota['lock']:
+                    # Google ya nos cortó: todos los hilos frenan hasta que la cubeta se recargue
+                    cuota['fichas'][tipo] = 0.0
+                    cuota['llamadas']['rechazos'].append(time.time())
+                time.sleep(2 ** intento + random.random())
+
 # --- FUNCIONES DE CONEXIÓN Y DATOS ---
 
 @st.cache_resource(ttl=3600) # Cache por 1 hora
@@ -59,70 +211,676 @@ def get_gspread_client():
         creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_json, scope)
         
         # Autorizar y obtener el cliente gspread
-        client = gspread.authorize(creds)
+        client = gspread.authorize(creds, http_client=ClienteHttpConCuota)
+        # Con mala señal, mejor fallar pronto y seguir sin conexión que congelar la pantalla
+        client.set_timeout(TIEMPO_ESPERA_RED)
         
         # Abrir la hoja de cálculo por ID
         spreadsheet = client.open_by_key(SPREADSHEET_ID)
         return spreadsheet
         
     except Exception as e:
-        # En caso de error, muestra un mensaje detallado para la configuración
-        st.error(f"""❌ Error Crítico de Conexión. Debe configurar una 'Service Account' (cuenta de servicio) de Google Sheets y subir el archivo JSON completo a Streamlit Secrets bajo la clave 'gserviceaccount' (texto JSON en una sola línea).
+        # En caso de error, el mensaje detallado para la configuración se muestra en el menú lateral
+        raise ConnectionError(f"""Debe configurar una 'Service Account' (cuenta de servicio) de Google Sheets y subir el archivo JSON completo a Streamlit Secrets bajo la clave 'gserviceaccount' (texto JSON en una sola línea), y tener conexión a internet.
         
-        Detalle: {e}""")
-        st.stop()
+        Detalle: {e}""") from e
 
+@st.cache_resource
+def _estado_conexion():
+    """Último error de conexión y cuándo ocurrió (compartido entre sesiones)."""
+    return {'error': None, 'fallo': 0.0}
 
-@st.cache_data(ttl=5) # Cache de 5 segundos para relecturas
-def read_sheet_to_df(sheet_name, expected_cols):
-    """Lee una hoja de cálculo por nombre de hoja y la convierte a DataFrame."""
+def conectar_hoja():
+    """
+    Devuelve la hoja de cálculo, o None si no hay conexión: la app sigue funcionando con la copia local
+    y la cola de escritura. Tras un fallo no se reintenta hasta pasados REINTENTO_CONEXION_SEGUNDOS,
+    para no demorar cada pantalla esperando a la red.
+    """
+    estado = _estado_conexion()
+    if time.time() - estado['fallo'] < REINTENTO_CONEXION_SEGUNDOS:
+        return None
     try:
         spreadsheet = get_gspread_client()
-        worksheet = spreadsheet.worksheet(sheet_name)
-        
-        # Obtener todos los valores y convertirlos a DataFrame
-        data = worksheet.get_all_records()
-        df = pd.DataFrame(data)
-        
-        if df.empty or len(df.columns) == 0:
-             return pd.DataFrame(columns=expected_cols)
+    except Exception as e:
+        estado['error'] = str(e)
+        estado['fallo'] = time.time()
+        return None
+    estado['error'] = None
+    return spreadsheet
 
-        # Rellenar cualquier columna faltante con NaN y asegurar el orden correcto
-        for col in expected_cols:
-            if col not in df.columns:
-                df[col] = pd.NA
 
-        return df[expected_cols] 
-        
-    except Exception as e:
-        st.error(f"❌ ERROR al leer los datos de la hoja '{sheet_name}'. Verifique que la hoja exista y que la Service Account tenga permisos de Editor. Detalle: {e}")
+@st.cache_resource
+def _hojas_abiertas():
+    """Worksheets ya abiertas (id, título y tamaño de grilla) de la conexión actual."""
+    return {'spreadsheet': None, 'hojas': {}, 'lock': threading.Lock()}
+
+def obtener_hoja(spreadsheet, sheet_name):
+    """
+    Devuelve la worksheet de una hoja sin pedir sus metadatos en cada llamada: todas se piden juntas
+    (una sola llamada) la primera vez, al cambiar la conexión o después de olvidar_hojas().
+    """
+    cache = _hojas_abiertas()
+    with cache['lock']:
+        if cache['spreadsheet'] is not spreadsheet or sheet_name not in cache['hojas']:
+            cache['hojas'] = {worksheet.title: worksheet for worksheet in spreadsheet.worksheets()}
+            cache['spreadsheet'] = spreadsheet
+        if sheet_name not in cache['hojas']:
+            raise gspread.exceptions.WorksheetNotFound(sheet_name)
+        return cache['hojas'][sheet_name]
+
+def olvidar_hojas():
+    """Descarta las worksheets abiertas (ej: tras un error por una hoja renombrada o achicada a mano)."""
+    cache = _hojas_abiertas()
+    with cache['lock']:
+        cache['hojas'] = {}
+
+def _ajustar_grilla(worksheet, filas=0, columnas=0):
+    """Anota en la worksheet abierta que su grilla creció en el servidor, sin volver a pedir sus metadatos."""
+    propiedades = worksheet._properties['gridProperties']
+    propiedades['rowCount'] = max(propiedades['rowCount'], filas)
+    propiedades['columnCount'] = max(propiedades['columnCount'], columnas)
+
+
+# --- CACHE LOCAL PERSISTENTE ---
+
+@st.cache_resource
+def _cache_local():
+    """Abre la base SQLite con la última copia conocida de cada hoja del servidor."""
+    conexion = sqlite3.connect(CACHE_LOCAL_PATH, check_same_thread=False)
+    conexion.execute("CREATE TABLE IF NOT EXISTS hojas (nombre TEXT PRIMARY KEY, revision TEXT, actualizado REAL)")
+    conexion.execute("CREATE TABLE IF NOT EXISTS filas (hoja TEXT, fila INTEGER, valores TEXT, PRIMARY KEY (hoja, fila))")
+    conexion.execute(
+        "CREATE TABLE IF NOT EXISTS pendientes (id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT, carga TEXT, "
+        "estado TEXT DEFAULT 'pendiente', intentos INTEGER DEFAULT 0, detalle TEXT, creado REAL)"
+    )
+    # Totales de la copia de Ventas por día x producto x vendedor x tipo de cliente (ver resumen_actual)
+    conexion.execute(
+        f"CREATE TABLE IF NOT EXISTS resumen_ventas ({', '.join(f'{c} TEXT' for c in RESUMEN_CLAVES)}, "
+        f"{', '.join(f'{c} INTEGER' for c in RESUMEN_TOTALES)}, PRIMARY KEY ({', '.join(RESUMEN_CLAVES)}))"
+    )
+    # Hasta qué fila de la copia de Ventas llega el resumen; 'era' cambia cada vez que la copia se reemplaza
+    conexion.execute("CREATE TABLE IF NOT EXISTS resumen_estado (id INTEGER PRIMARY KEY CHECK (id = 1), era INTEGER, filas INTEGER, ultimo_id TEXT)")
+    if conexion.execute("PRAGMA user_version").fetchone()[0] != FORMATO_CACHE_LOCAL:
+        # Las copias de otro formato se descartan (la cola de escritura se conserva)
+        conexion.execute("DELETE FROM hojas")
+        conexion.execute("DELETE FROM filas")
+        conexion.execute("DELETE FROM resumen_ventas")
+        conexion.execute("DELETE FROM resumen_estado")
+        conexion.execute(f"PRAGMA user_version = {FORMATO_CACHE_LOCAL}")
+    conexion.commit()
+    # 'memoria' guarda de cada copia solo lo que se consulta seguido (las filas se leen del disco); 'refrescando' evita hilos duplicados;
+    # 'escritura' impide que una descarga pise la copia local mientras se envía un lote de la cola;
+    # 'resumen' es el resumen guardado de Ventas ya leído del disco; 'version' numera los cambios de filas de las copias
+    return {
+        'conexion': conexion, 'lock': threading.RLock(), 'memoria': {}, 'refrescando': set(),
+        'escritura': threading.RLock(), 'envios': {}, 'avisos': [], 'resumen': None, 'version': 0
+    }
+
+def _nueva_version(cache):
+    """Número nuevo (creciente en el proceso) para una copia cuyas filas cambiaron. Se llama con el lock tomado."""
+    cache['version'] += 1
+    return cache['version']
+
+def leer_snapshot(sheet_name):
+    """
+    Devuelve los datos de la copia local de una hoja que se consultan seguido, o None si nunca se descargó:
+    {'filas' (cuántas filas guardadas, con el encabezado), 'encabezado', 'ultima' (última fila), 'revision',
+    'actualizado', 'version'}. Las filas completas quedan en el disco y se leen con leer_filas cuando hacen falta.
+    'version' cambia cada vez que cambian sus filas o los datos que identifican a un producto (no con el stock).
+    """
+    cache = _cache_local()
+    with cache['lock']:
+        if sheet_name not in cache['memoria']:
+            conexion = cache['conexion']
+            meta = conexion.execute("SELECT revision, actualizado FROM hojas WHERE nombre = ?", (sheet_name,)).fetchone()
+            if meta is None:
+                return None
+            filas = conexion.execute("SELECT COUNT(*) FROM filas WHERE hoja = ?", (sheet_name,)).fetchone()[0]
+            cache['memoria'][sheet_name] = {
+                'filas': filas,
+                'encabezado': leer_filas(sheet_name, 0, 1)[0] if filas else [],
+                'ultima': leer_filas(sheet_name, filas - 1, filas)[0] if filas else None,
+                'revision': meta[0],
+                'actualizado': meta[1],
+                'version': _nueva_version(cache)
+            }
+        return cache['memoria'][sheet_name]
+
+def leer_filas(sheet_name, desde=0, hasta=None):
+    """Filas de la copia local de una hoja con desde <= número de fila < hasta (la fila 0 es el encabezado), del disco."""
+    cache = _cache_local()
+    with cache['lock']:
+        filas = cache['conexion'].execute(
+            "SELECT valores FROM filas WHERE hoja = ? AND fila >= ? AND fila < ? ORDER BY fila",
+            (sheet_name, desde, hasta if hasta is not None else 2 ** 62)
+        ).fetchall()
+    # Un solo json.loads para todas (mucho más rápido que uno por fila)
+    return json.loads('[' + ','.join(valores for (valores,) in filas) + ']')
+
+def guardar_snapshot(sheet_name, datos, revision=None):
+    """Reemplaza la copia local completa de una hoja (disco y datos en memoria)."""
+    cache = _cache_local()
+    with cache['lock']:
+        previo = leer_snapshot(sheet_name)
+        anteriores = leer_filas(sheet_name) if previo is not None else None
+        # Si la hoja solo creció al final (ej: ventas de otro vendedor), lo ya resumido de Ventas sigue valiendo
+        solo_crecio = previo is not None and len(datos) >= len(anteriores) and datos[:len(anteriores)] == anteriores
+        # Si solo cambió el stock (ej: la copia del inventario que se vuelve a bajar tras una venta), la versión se conserva
+        claves = [j for j, col in enumerate(datos[0]) if col in COLUMNAS_INDEXADAS] if datos else []
+        misma_version = (
+            bool(claves) and previo is not None and len(anteriores) == len(datos) and anteriores[0] == datos[0]
+            and all([fila[j] for fila in anteriores[1:]] == [fila[j] for fila in datos[1:]] for j in claves)
+        )
+        del anteriores
+        conexion = cache['conexion']
+        with conexion:
+            conexion.execute("INSERT OR REPLACE INTO hojas (nombre, revision, actualizado) VALUES (?, ?, ?)", (sheet_name, revision, time.time()))
+            conexion.execute("DELETE FROM filas WHERE hoja = ?", (sheet_name,))
+            conexion.executemany(
+                "INSERT INTO filas (hoja, fila, valores) VALUES (?, ?, ?)",
+                ((sheet_name, i, json.dumps(fila)) for i, fila in enumerate(datos))
+            )
+            if sheet_name == VENTAS_SHEET_NAME and not solo_crecio:
+                _invalidar_resumen(cache)
+        cache['memoria'][sheet_name] = {
+            'filas': len(datos),
+            'encabezado': list(datos[0]) if datos else [],
+            'ultima': list(datos[-1]) if datos else None,
+            'revision': revision,
+            'actualizado': time.time(),
+            'version': previo['version'] if misma_version else _nueva_version(cache)
+        }
+
+def agregar_filas_snapshot(sheet_name, filas):
+    """Agrega filas al final de la copia local de una hoja sin reescribirla."""
+    snapshot = leer_snapshot(sheet_name)
+    if snapshot is None or not filas:
+        return
+    cache = _cache_local()
+    with cache['lock']:
+        inicio = snapshot['filas']
+        with cache['conexion'] as conexion:
+            conexion.executemany(
+                "INSERT OR REPLACE INTO filas (hoja, fila, valores) VALUES (?, ?, ?)",
+                ((sheet_name, inicio + i, json.dumps(fila)) for i, fila in enumerate(filas))
+            )
+        if not snapshot['filas']:
+            snapshot['encabezado'] = list(filas[0])
+        snapshot['filas'] += len(filas)
+        snapshot['ultima'] = list(filas[-1])
+        snapshot['version'] = _nueva_version(cache)
+
+def actualizar_celda_snapshot(sheet_name, fila, columna, valor):
+    """Actualiza una celda de la copia local (fila y columna empiezan en 0; la fila 0 es el encabezado)."""
+    snapshot = leer_snapshot(sheet_name)
+    if snapshot is None or fila >= snapshot['filas']:
+        return
+    cache = _cache_local()
+    with cache['lock']:
+        valores = leer_filas(sheet_name, fila, fila + 1)[0]
+        valores[columna] = valor
+        if snapshot['encabezado'][columna] in COLUMNAS_INDEXADAS:
+            snapshot['version'] = _nueva_version(cache)
+        if fila == 0:
+            snapshot['encabezado'] = list(valores)
+        if fila == snapshot['filas'] - 1:
+            snapshot['ultima'] = list(valores)
+        with cache['conexion'] as conexion:
+            conexion.execute("UPDATE filas SET valores = ? WHERE hoja = ? AND fila = ?", (json.dumps(valores), sheet_name, fila))
+            if sheet_name == VENTAS_SHEET_NAME:
+                _invalidar_resumen(cache)
+
+def marcar_revision(sheet_name, revision):
+    """Registra que la copia local de una hoja corresponde a una revisión del servidor."""
+    snapshot = leer_snapshot(sheet_name)
+    if snapshot is None:
+        return
+    cache = _cache_local()
+    with cache['lock']:
+        with cache['conexion'] as conexion:
+            conexion.execute("UPDATE hojas SET revision = ?, actualizado = ? WHERE nombre = ?", (revision, time.time(), sheet_name))
+        snapshot['revision'] = revision
+        snapshot['actualizado'] = time.time()
+
+def _invalidar_resumen(cache):
+    """
+    La copia de Ventas se reemplazó o se editó (no solo creció al final): el resumen guardado deja de valer.
+    Se llama con el lock tomado y dentro de la transacción que cambia la copia.
+    """
+    conexion = cache['conexion']
+    era = conexion.execute("SELECT era FROM resumen_estado").fetchone()
+    conexion.execute("INSERT OR REPLACE INTO resumen_estado (id, era, filas, ultimo_id) VALUES (1, ?, 0, NULL)", ((era[0] if era else 0) + 1,))
+    conexion.execute("DELETE FROM resumen_ventas")
+    cache['resumen'] = None
+
+def era_resumen():
+    """Era actual de la copia de Ventas (cambia cada vez que la copia se reemplaza)."""
+    cache = _cache_local()
+    with cache['lock']:
+        era = cache['conexion'].execute("SELECT era FROM resumen_estado").fetchone()
+        return era[0] if era else 0
+
+def leer_resumen():
+    """
+    Resumen guardado de la copia de Ventas: {'era', 'filas' (cuántas filas de la copia incluye),
+    'ultimo_id' (ID_VENTA de la última incluida), 'totales' ({clave: [totales]}, copia propia)}.
+    """
+    cache = _cache_local()
+    with cache['lock']:
+        if cache['resumen'] is None:
+            conexion = cache['conexion']
+            estado = conexion.execute("SELECT era, filas, ultimo_id FROM resumen_estado").fetchone() or (0, 0, None)
+            columnas = ', '.join(RESUMEN_CLAVES + RESUMEN_TOTALES)
+            totales = {}
+            for fila in conexion.execute(f"SELECT {columnas} FROM resumen_ventas"):
+                totales[fila[:len(RESUMEN_CLAVES)]] = list(fila[len(RESUMEN_CLAVES):])
+            cache['resumen'] = {'era': estado[0], 'filas': estado[1], 'ultimo_id': estado[2], 'totales': totales}
+        guardado = cache['resumen']
+        return dict(guardado, totales={clave: list(valores) for clave, valores in guardado['totales'].items()})
+
+def guardar_resumen(era, desde, hasta, nuevos, reemplazar=False):
+    """
+    Suma al resumen guardado los totales (nuevos) de las filas de la copia de Ventas entre desde y hasta,
+    cada uno (filas, ID_VENTA de la última fila), o lo reemplaza por ellos.
+    No guarda nada si la copia se reemplazó después de leerla (otra era) o si otra sesión ya avanzó
+    el resumen desde que se leyó (sumar de nuevo esas filas las contaría dos veces). Devuelve si se guardó.
+    """
+    cache = _cache_local()
+    with cache['lock']:
+        if era != era_resumen():
+            return False
+        guardado = leer_resumen()
+        if not reemplazar and (guardado['filas'], guardado['ultimo_id']) != tuple(desde):
+            return False
+        if reemplazar:
+            guardado = {'totales': {}}
+        filas, ultimo_id = hasta
+        sumar_resumen(guardado['totales'], nuevos)
+        columnas = RESUMEN_CLAVES + RESUMEN_TOTALES
+        with cache['conexion'] as conexion:
+            if reemplazar:
+                conexion.execute("DELETE FROM resumen_ventas")
+            # Solo las claves que cambiaron, ya con el total acumulado
+            conexion.executemany(
+                f"INSERT OR REPLACE INTO resumen_ventas ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})",
+                (clave + tuple(guardado['totales'][clave]) for clave in nuevos)
+            )
+            conexion.execute("INSERT OR REPLACE INTO resumen_estado (id, era, filas, ultimo_id) VALUES (1, ?, ?, ?)", (era, filas, ultimo_id))
+        cache['resumen'] = {'era': era, 'filas': filas, 'ultimo_id': ultimo_id, 'totales': guardado['totales']}
+        return True
+
+def fecha_modificacion(spreadsheet):
+    """Consulta barata de cambios: fecha de última modificación del archivo en Drive (no baja datos)."""
+    return spreadsheet.get_lastUpdateTime()
+
+def _datos_desde_valores(valores):
+    """
+    Arma encabezado + filas a partir de los valores de una hoja tal como los devuelve la API:
+    texto sin convertir, con las filas completadas hasta el ancho de la hoja.
+    """
+    if not valores:
+        return []
+    ancho = max(len(fila) for fila in valores)
+    return [fila + [''] * (ancho - len(fila)) for fila in valores]
+
+def descargar_hojas(spreadsheet, sheet_names, revision=None):
+    """
+    Descarga de Google Sheets las hojas que cambiaron desde su última copia local, todas juntas en una
+    sola llamada values.batchGet. Se puede pasar la revisión ya consultada para no repetir la consulta.
+    Devuelve {hoja: datos de su copia local (ver leer_snapshot)}. No usa funciones de Streamlit: se puede llamar desde un hilo en segundo plano.
+    """
+    # La fecha se consulta antes de bajar los datos: si alguien edita durante la descarga,
+    # la próxima consulta verá una fecha distinta y se volverá a descargar
+    with _cache_local()['escritura']:
+        if revision is None:
+            revision = fecha_modificacion(spreadsheet)
+        vencidas = []
+        for sheet_name in sheet_names:
+            snapshot = leer_snapshot(sheet_name)
+            if snapshot is not None and snapshot['revision'] == revision:
+                marcar_revision(sheet_name, revision)
+            else:
+                vencidas.append(sheet_name)
+
+        if vencidas:
+            try:
+                respuesta = spreadsheet.values_batch_get([gspread.utils.absolute_range_name(nombre) for nombre in vencidas])
+                valores = [rango.get('values', []) for rango in respuesta.get('valueRanges', [])]
+            except gspread.exceptions.APIError as e:
+                # Si el lote completo se rechaza (ej: permisos distintos por hoja), se lee cada una por su lado
+                if _es_error_transitorio(e) or len(vencidas) == 1:
+                    raise
+                valores = _leer_en_paralelo(spreadsheet, vencidas)
+
+            errores = []
+            for sheet_name, valores_hoja in zip(vencidas, valores):
+                if isinstance(valores_hoja, Exception):
+                    errores.append(valores_hoja)
+                else:
+                    guardar_snapshot(sheet_name, _datos_desde_valores(valores_hoja), revision)
+            if errores:
+                raise errores[0]
+        return {sheet_name: leer_snapshot(sheet_name) for sheet_name in sheet_names}
+
+def _leer_en_paralelo(spreadsheet, sheet_names):
+    """
+    Baja varias hojas a la vez, una por hilo, todas con el mismo plazo (TIEMPO_MAXIMO_LECTURA desde que empiezan).
+    Devuelve, en el mismo orden, los valores de cada hoja o la excepción con la que falló.
+    """
+    pool = ThreadPoolExecutor(max_workers=len(sheet_names))
+    futuros = [
+        pool.submit(spreadsheet.values_get, gspread.utils.absolute_range_name(nombre))
+        for nombre in sheet_names
+    ]
+    terminados, _ = wait(futuros, timeout=TIEMPO_MAXIMO_LECTURA)
+    resultados = []
+    for nombre, futuro in zip(sheet_names, futuros):
+        if futuro not in terminados:
+            resultados.append(TimeoutError(f"La hoja '{nombre}' no respondió en {TIEMPO_MAXIMO_LECTURA} segundos."))
+            continue
+        try:
+            resultados.append(futuro.result().get('values', []))
+        except Exception as e:
+            resultados.append(e)
+    # Sin esperar a un hilo colgado: la lectura vencida ya quedó registrada como error
+    pool.shutdown(wait=False)
+    return resultados
+
+def descargar_hoja(spreadsheet, sheet_name, revision=None):
+    """Descarga una sola hoja si cambió (ver descargar_hojas)."""
+    return descargar_hojas(spreadsheet, [sheet_name], revision)[sheet_name]
+
+def revision_actual(spreadsheet):
+    """Fecha de modificación actual del archivo, o None si no se pudo consultar."""
+    try:
+        return fecha_modificacion(spreadsheet)
+    except Exception:
+        return None
+
+class ConflictoDeVersion(Exception):
+    """Otro vendedor modificó la hoja después de la revisión sobre la que se calculó el cambio."""
+
+def verificar_revision(spreadsheet, revision_base):
+    """
+    Devuelve la revisión actual del archivo antes de escribir.
+    Si se indica revision_base y el archivo cambió desde entonces, lanza ConflictoDeVersion.
+    """
+    revision = revision_actual(spreadsheet)
+    if revision_base is not None and revision != revision_base:
+        raise ConflictoDeVersion(f"La hoja cambió (revisión {revision_base} -> {revision}).")
+    return revision
+
+def confirmar_revision(spreadsheet, revision_previa):
+    """
+    Tras una escritura propia, adopta la nueva fecha de modificación en la copia local de Ventas si estaba al día
+    justo antes de escribir y en el servidor no hay filas después de la última de la copia: no se vuelve a bajar
+    por nuestro cambio, pero sí si otro vendedor agregó ventas en el medio.
+    La copia del inventario nunca la adopta: se vuelve a bajar una vez y así se ve cualquier cambio ajeno.
+    """
+    if revision_previa is None:
+        return
+    snapshot = leer_snapshot(VENTAS_SHEET_NAME)
+    if snapshot is None or snapshot['revision'] != revision_previa or 'ID_VENTA' not in snapshot['encabezado']:
+        return
+    # La fecha se consulta antes de mirar el final de la hoja: lo que se agregue después la cambia y se baja
+    revision = revision_actual(spreadsheet)
+    if revision is None:
+        return
+    fila = snapshot['filas']
+    k = snapshot['encabezado'].index('ID_VENTA')
+    inicio = gspread.utils.rowcol_to_a1(fila, k + 1)
+    columna = inicio.rstrip('0123456789')
+    valores = obtener_hoja(spreadsheet, VENTAS_SHEET_NAME).get(f"{inicio}:{columna}")
+    if [(valor + [''])[0] for valor in valores] == [snapshot['ultima'][k]]:
+        marcar_revision(VENTAS_SHEET_NAME, revision)
+
+def refrescar_en_segundo_plano(spreadsheet):
+    """Lanza (una sola a la vez) la descarga de las hojas que cambiaron en un hilo aparte."""
+    cache = _cache_local()
+    with cache['lock']:
+        if cache['refrescando']:
+            return
+        cache['refrescando'].add('hojas')
+
+    def tarea():
+        try:
+            descargar_hojas(spreadsheet, list(CLAVES_HOJA))
+        except Exception as e:
+            # Si falla, se reintenta en la próxima lectura con la copia vencida
+            if not _es_error_transitorio(e):
+                olvidar_hojas()
+        finally:
+            with cache['lock']:
+                cache['refrescando'].discard('hojas')
+
+    threading.Thread(target=tarea, daemon=True).start()
+
+def _df_desde_snapshot(datos, expected_cols):
+    """
+    Arma el DataFrame de una hoja columna por columna a partir de su copia local, en el orden de expected_cols.
+    Todas las columnas quedan con el texto de la hoja: cargar_inventario / cargar_ventas convierten una sola vez las numéricas.
+    """
+    if len(datos) < 2:
         return pd.DataFrame(columns=expected_cols)
+    posiciones = {col: j for j, col in enumerate(datos[0])}
+    filas = datos[1:]
 
-def write_df_to_sheet(sheet_name, df, expected_cols):
-    """Escribe un DataFrame completo a una hoja de cálculo, reemplazando todo."""
-    
+    columnas = {}
+    for col in expected_cols:
+        j = posiciones.get(col)
+        if j is None:
+            # Rellenar cualquier columna faltante con NA
+            columnas[col] = np.full(len(filas), pd.NA, dtype=object)
+        else:
+            columnas[col] = np.array([fila[j] for fila in filas], dtype=object)
+    return pd.DataFrame(columnas)
+
+# --- ESCRITURA INCREMENTAL ---
+
+def _registrar_envio(sheet_name, celdas_enviadas, celdas_totales):
+    """Guarda cuántas celdas se enviaron en la última escritura de una hoja (para el menú lateral)."""
+    cache = _cache_local()
+    cache['envios'][sheet_name] = (celdas_enviadas, celdas_totales)
+    cache['ultimo_envio'] = datetime.now().strftime('%H:%M:%S')
+
+def calcular_cambios(previo, nuevo, clave):
+    """
+    Compara la copia del servidor con los datos a guardar, fila por fila según la columna clave.
+    Las filas nuevas se comparan como texto contra la copia local.
+    Devuelve (rangos para batch_update, celdas enviadas, nueva copia del servidor), o None si
+    el cambio no se puede expresar sin reescribir la hoja (sin copia previa, encabezados
+    distintos, claves duplicadas o filas eliminadas).
+    """
+    if not previo or previo[0] != nuevo[0]:
+        return None
+
+    encabezado = nuevo[0]
+    k = encabezado.index(clave)
+    posiciones = {str(fila[k]): i for i, fila in enumerate(previo[1:], start=1)}
+    claves_nuevas = {fila[k] for fila in nuevo[1:]}
+    if len(posiciones) != len(previo) - 1 or len(claves_nuevas) != len(nuevo) - 1:
+        return None
+    if set(posiciones) - claves_nuevas:
+        return None
+
+    resultado = [list(fila) for fila in previo]
+    rangos = []
+    agregadas = []
+    celdas = 0
+    for fila in nuevo[1:]:
+        i = posiciones.get(fila[k])
+        if i is None:
+            agregadas.append(fila)
+            continue
+        anterior = [str(v) for v in previo[i]] + [''] * (len(encabezado) - len(previo[i]))
+        cambiadas = [j for j in range(len(encabezado)) if anterior[j] != fila[j]]
+        if cambiadas:
+            # Un rango por fila, desde la primera hasta la última celda modificada
+            a, b = cambiadas[0], cambiadas[-1]
+            rangos.append({
+                'range': f"{gspread.utils.rowcol_to_a1(i + 1, a + 1)}:{gspread.utils.rowcol_to_a1(i + 1, b + 1)}",
+                'values': [fila[a:b + 1]]
+            })
+            celdas += b - a + 1
+            resultado[i] = fila
+
+    if agregadas:
+        # Las filas nuevas van juntas al final de la hoja
+        inicio = len(previo) + 1
+        rangos.append({
+            'range': f"{gspread.utils.rowcol_to_a1(inicio, 1)}:{gspread.utils.rowcol_to_a1(inicio + len(agregadas) - 1, len(encabezado))}",
+            'values': agregadas
+        })
+        celdas += len(agregadas) * len(encabezado)
+        resultado.extend(agregadas)
+
+    return rangos, celdas, resultado
+
+
+def reescribir_hoja(spreadsheet, worksheet, data_to_write):
+    """
+    Reemplaza todo el contenido de la hoja en una sola petición batchUpdate.
+    El updateCells sobre la hoja entera escribe los datos y borra lo que sobra en el mismo paso,
+    así la hoja nunca queda vacía aunque el proceso se corte a mitad del guardado.
+    """
+    requests = []
+    filas = len(data_to_write)
+    columnas = max(len(fila) for fila in data_to_write)
+    # La grilla debe tener lugar para todos los datos antes de escribirlos
+    if filas > worksheet.row_count:
+        requests.append({'appendDimension': {'sheetId': worksheet.id, 'dimension': 'ROWS', 'length': filas - worksheet.row_count}})
+    if columnas > worksheet.col_count:
+        requests.append({'appendDimension': {'sheetId': worksheet.id, 'dimension': 'COLUMNS', 'length': columnas - worksheet.col_count}})
+
+    requests.append({'updateCells': {
+        # Rango sin límites = toda la hoja: las celdas no cubiertas por 'rows' se limpian
+        'range': {'sheetId': worksheet.id},
+        'rows': [{'values': [{'userEnteredValue': {'stringValue': valor}} for valor in fila]} for fila in data_to_write],
+        'fields': 'userEnteredValue'
+    }})
+    spreadsheet.batch_update({'requests': requests})
+    _ajustar_grilla(worksheet, filas, columnas)
+
+
+def revisar_copia(sheet_name):
+    """
+    Se asegura de que haya copia local de una hoja: en un arranque sin copia la descarga; si la copia
+    está vencida, en segundo plano se consulta si el archivo cambió antes de bajarlo.
+    """
+    snapshot = leer_snapshot(sheet_name)
+    if snapshot is None:
+        spreadsheet = conectar_hoja()
+        if spreadsheet is None:
+            raise ConnectionError("No hay conexión con Google Sheets ni una copia local de la hoja.")
+        # En el arranque se bajan todas las hojas en una sola llamada (la siguiente lectura ya tiene copia)
+        descargar_hojas(spreadsheet, list(CLAVES_HOJA))
+    elif time.time() - snapshot['actualizado'] > REFRESCO_SEGUNDOS and cuota_disponible('lectura') >= CUOTA_MINIMA_REFRESCO:
+        # Sin conexión (o con poca cuota de lectura libre) se sigue con la copia local
+        spreadsheet = conectar_hoja()
+        if spreadsheet is not None:
+            refrescar_en_segundo_plano(spreadsheet)
+
+def leer_ventas_desde(fila):
+    """
+    Lee de la copia local de Ventas solo las filas posteriores a 'fila' (sin contar el encabezado) y las ventas
+    en cola, como texto y sin armar el historial completo. Devuelve {'era', 'filas_copia' (filas de la copia),
+    'encabezado', 'anterior' (la fila número 'fila', o None), 'nuevas', 'cola'}.
+    """
+    revisar_copia(VENTAS_SHEET_NAME)
+    with _cache_local()['lock']:
+        snapshot = leer_snapshot(VENTAS_SHEET_NAME)
+        encabezado = snapshot['encabezado'] or VENTAS_COLS
+        filas_copia = max(0, snapshot['filas'] - 1)
+        # Del disco se leen solo la fila 'fila' (para comprobar que sigue siendo la misma) y las posteriores
+        anterior = leer_filas(VENTAS_SHEET_NAME, fila, fila + 1) if fila > 0 else []
+        nuevas = leer_filas(VENTAS_SHEET_NAME, fila + 1)
+        cola = []
+        for pendiente in leer_pendientes():
+            if pendiente['tipo'] == 'ventas':
+                cola.extend(aplicar_pendiente(VENTAS_SHEET_NAME, [encabezado], 'ventas', pendiente['carga'])[1:])
+        return {
+            'era': era_resumen(), 'filas_copia': filas_copia, 'encabezado': encabezado,
+            'anterior': anterior[0] if anterior else None, 'nuevas': nuevas, 'cola': cola
+        }
+
+@st.cache_data(ttl=5) # Cache de 5 segundos para relecturas
+def read_sheet_to_df(sheet_name, expected_cols):
+    """
+    Lee una hoja desde la copia local (SQLite) más los cambios que todavía esperan en la cola de escritura.
+    Solo se descarga de Google Sheets en un arranque sin copia; si la copia está vencida,
+    se devuelve igual y en segundo plano se consulta si el archivo cambió antes de bajarlo.
+    """
     try:
-        spreadsheet = get_gspread_client()
-        worksheet = spreadsheet.worksheet(sheet_name)
-        
-        # Aseguramos que solo guardamos las columnas correctas en el orden correcto
-        df_to_write = df[[c for c in expected_cols if c in df.columns]]
-        
-        # Convertir el DataFrame a una lista de listas (incluyendo encabezados)
-        data_to_write = [expected_cols] + df_to_write.astype(str).values.tolist()
-        
-        # Escribir todos los datos
-        worksheet.clear() # Limpia la hoja
-        # A1 es la celda de inicio para la escritura
-        worksheet.update('A1', data_to_write)
+        revisar_copia(sheet_name)
+
+        # Copia y cola se leen juntas: el hilo de envío actualiza ambas bajo el mismo lock
+        with _cache_local()['lock']:
+            snapshot = leer_snapshot(sheet_name)
+            datos = leer_filas(sheet_name)
+            filas_copia = max(0, len(datos) - 1)
+            era = era_resumen()
+            pendientes = leer_pendientes()
+            for pendiente in pendientes:
+                datos = aplicar_pendiente(sheet_name, datos, pendiente['tipo'], pendiente['carga'])
+        df = _df_desde_snapshot(datos, expected_cols)
+        # Para AlmacenVentas.sincronizar: qué filas vienen de la copia local (el resto son ventas en cola).
+        # 'version' identifica las filas del resultado: la de la copia y los cambios en cola que agregan o quitan filas
+        # de esta hoja (las ventas en cola solo descuentan stock del inventario)
+        cambian_filas = [p['id'] for p in pendientes if (p['tipo'] == 'ventas') == (sheet_name == VENTAS_SHEET_NAME)]
+        df.attrs.update({'filas_copia': filas_copia, 'era': era, 'version': (snapshot['version'], tuple(cambian_filas))})
+        return df
         
-        st.session_state['data_saved'] = datetime.now().strftime('%H:%M:%S')
     except Exception as e:
-        st.error(f"❌ ERROR al guardar los datos en la hoja '{sheet_name}'. El permiso de la hoja debe ser 'Editor' para la Service Account. Detalle: {e}")
-        st.stop()
+        olvidar_hojas()
+        st.error(f"❌ ERROR al leer los datos de la hoja '{sheet_name}'. Verifique que la hoja exista y que la Service Account tenga permisos de Editor. Detalle: {e}")
+        return pd.DataFrame(columns=expected_cols)
+
+def escribir_hoja(spreadsheet, sheet_name, data_to_write):
+    """
+    Sincroniza una hoja con data_to_write (encabezado + filas de texto) enviando solo las celdas que cambiaron.
+    Si no hay copia previa del servidor o el cambio es demasiado grande, reemplaza todo.
+    No usa funciones de Streamlit: la llama el hilo de la cola de escritura.
+    """
+    worksheet = obtener_hoja(spreadsheet, sheet_name)
+    celdas_totales = len(data_to_write) * len(data_to_write[0])
+
+    snapshot = leer_snapshot(sheet_name)
+    cambios = calcular_cambios(leer_filas(sheet_name) if snapshot else None, data_to_write, CLAVES_HOJA[sheet_name])
+
+    if cambios is not None and cambios[1] <= UMBRAL_REESCRITURA * celdas_totales:
+        # Solo los rangos modificados, en una única llamada
+        rangos, celdas_enviadas, datos = cambios
+        if rangos:
+            if len(datos) > worksheet.row_count:
+                worksheet.add_rows(len(datos) - worksheet.row_count)
+            worksheet.batch_update(rangos)
+    else:
+        # Escribir todos los datos (sobrescribe y recorta en una única petición atómica)
+        reescribir_hoja(spreadsheet, worksheet, data_to_write)
+        celdas_enviadas = celdas_totales
+        datos = data_to_write
+
+    # La copia local queda igual que el servidor pero con la revisión anterior: se vuelve a bajar una vez (ver confirmar_revision)
+    guardar_snapshot(sheet_name, datos, snapshot['revision'] if snapshot else None)
+    _registrar_envio(sheet_name, celdas_enviadas, celdas_totales)
 
 # --- FUNCIONES DE UTILIDAD ---
 
+# Texto en memoria: strings de pyarrow (viene con streamlit) ocupan mucho menos que objetos de Python.
+# pyarrow es obligatorio: también lo usan las conversiones en bloque de números y precios
+TIPO_TEXTO = pd.StringDtype('pyarrow')
+
+# dtype de pandas para cada tipo del esquema
+DTYPES_ESQUEMA = {'texto': TIPO_TEXTO, 'categoria': 'category', 'cantidad': 'int32', 'dinero': 'int64', 'fecha': 'datetime64[s]'}
+
+def aplicar_esquema(df, esquema):
+    """Convierte cada columna (ya limpia) al tipo compacto declarado en el esquema. Se aplica una vez, al cargar."""
+    return df.astype({col: DTYPES_ESQUEMA[tipo] for col, tipo in esquema.items() if col in df.columns})
+
+def memoria_mb(df):
+    """Memoria ocupada por un DataFrame, contando el contenido de los textos, en MB."""
+    return df.memory_usage(deep=True).sum() / 1e6
+
 def clean_input(text):
     """Limpia el texto, elimina tildes/ñ y convierte a mayúsculas para la búsqueda."""
     if not isinstance(text, str):
@@ -143,43 +901,1069 @@ def parse_price(value):
     except:
         return 0.0
 
+def a_centavos(value):
+    """parse_price en centavos enteros (ej: '2.000,50' -> 200050). Lo que no es un número finito cuenta 0."""
+    valor = parse_price(value)
+    return int(round(valor * 100)) if np.isfinite(valor) else 0
+
+def centavos_series(serie):
+    """a_centavos para una columna de texto crudo de la hoja, en bloque (int64)."""
+    valores = np.rint(parse_price_texto_series(serie).to_numpy() * 100)
+    valores[~np.isfinite(valores)] = 0
+    return pd.Series(valores.astype('int64'), index=serie.index)
+
+def centavos_a_texto(centavos):
+    """Texto con que se escribe un importe en la hoja (el mismo que escribía el float: 40000 -> '400.0')."""
+    return str(int(centavos) / 100)
+
+def formato_dinero(centavos):
+    """Importe en centavos para mostrar (ej: 123450 -> '$1,234.50'), sin pasar por float."""
+    centavos = int(centavos)
+    pesos, resto = divmod(abs(centavos), 100)
+    return f"${'-' if centavos < 0 else ''}{pesos:,}.{resto:02d}"
+
+# Números que la conversión en bloque interpreta igual que float() (ej: '2000.50', '-3', '1e5')
+PATRON_NUMERO_SIMPLE = r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d{1,3})?'
+
+def _texto_a_float(texto):
+    """float() de un texto ya limpio, o 0.0 si no es un número (igual que parse_price)."""
+    try:
+        return float(texto)
+    except:
+        return 0.0
+
+def numero_de_celda(texto):
+    """Número de una celda de texto tal como lo interpreta numericise (get_all_records), o NaN si no es un número."""
+    valor = gspread.utils.numericise(texto) if isinstance(texto, str) else texto
+    return float(valor) if isinstance(valor, (int, float)) else np.nan
+
+def numerizar_texto_series(serie):
+    """
+    Versión en bloque de numero_de_celda para una columna de texto crudo de la hoja.
+    Devuelve (valores float64, máscara de las celdas que son números).
+    """
+    texto = pd.Series(serie.to_numpy(dtype=object), dtype=TIPO_TEXTO)
+    simples = texto.str.fullmatch(PATRON_NUMERO_SIMPLE).fillna(False).to_numpy(dtype=bool)
+    valores = np.full(len(texto), np.nan)
+    valores[simples] = texto[simples].astype('float64[pyarrow]').to_numpy(dtype='float64')
+
+    # Lo que no es un número simple (vacíos, espacios, 'nan', texto) pasa una a una por numericise
+    es_numero = simples.copy()
+    resto = np.flatnonzero(~simples)
+    for i, celda in zip(resto, serie.to_numpy(dtype=object)[resto]):
+        valor = gspread.utils.numericise(celda) if isinstance(celda, str) else celda
+        if isinstance(valor, (int, float)):
+            valores[i] = valor
+            es_numero[i] = True
+    return valores, es_numero
+
+def parse_price_texto_series(serie):
+    """
+    parse_price para una columna de texto crudo de la hoja, con el mismo resultado que tenía sobre
+    get_all_records: los números se toman tal cual ('1000.5' -> 1000.5) y el resto pasa por parse_price
+    ('2.000,50' -> 2000.5).
+    """
+    valores, es_numero = numerizar_texto_series(serie)
+    if not es_numero.all():
+        otros = pd.Series(serie.to_numpy(dtype=object)[~es_numero], dtype=object)
+        valores[~es_numero] = parse_price_series(otros).to_numpy()
+    return pd.Series(valores, index=serie.index)
+
+def parse_price_series(serie):
+    """
+    Versión vectorizada de parse_price para una columna completa, con los mismos resultados.
+    Solo las celdas que no son números simples (basura, vacíos, 'nan', '1_000') pasan una a una por Python.
+    """
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        return serie.astype('float64')
+
+    valores = serie.to_numpy(dtype=object)
+    resultado = np.zeros(len(valores))
+
+    tipo = pd.api.types.infer_dtype(valores, skipna=False)
+    if tipo == 'string':
+        es_texto = np.ones(len(valores), dtype=bool)
+    elif tipo in ('integer', 'floating', 'mixed-integer-float', 'empty'):
+        es_texto = np.zeros(len(valores), dtype=bool)
+    else:
+        es_texto = np.fromiter((type(v) is str for v in valores), dtype=bool, count=len(valores))
+
+    if es_texto.any():
+        # Mismo reemplazo de separadores que parse_price ('2.000,50' -> '2000.50'), en bloque
+        limpio = pd.Series(valores[es_texto], dtype=TIPO_TEXTO).str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+        simples = limpio.str.fullmatch(PATRON_NUMERO_SIMPLE).to_numpy(dtype=bool)
+        convertidos = np.zeros(len(limpio))
+        convertidos[simples] = limpio[simples].astype('float64[pyarrow]').to_numpy(dtype='float64')
+        convertidos[~simples] = [_texto_a_float(texto) for texto in limpio[~simples]]
+        resultado[es_texto] = convertidos
+
+    # Números sueltos (int/float); lo que no se convierta (None, pd.NA, NaN, otros tipos) va por parse_price
+    otros = ~es_texto
+    if otros.any():
+        numeros = np.array(pd.to_numeric(pd.Series(valores[otros], dtype=object), errors='coerce'), dtype='float64')
+        fallidos = np.isnan(numeros)
+        numeros[fallidos] = [parse_price(v) for v in valores[otros][fallidos]]
+        resultado[otros] = numeros
+
+    return pd.Series(resultado, index=serie.index)
+
+# --------------------------------------------------------------------
+# ÍNDICES DEL INVENTARIO (BÚSQUEDA EXACTA Y POR TEXTO)
+# --------------------------------------------------------------------
+
+# Columnas del inventario que se indexan para ubicar un producto en tiempo constante
+COLUMNAS_INDEXADAS = ['NOMBRE_PRODUCTO', 'CODIGO_SKU', 'ID_PRODUCTO']
+
+def construir_indice_inventario(inventario_df):
+    """
+    Arma índices hash (valor -> etiqueta de fila) por nombre, SKU e ID del producto,
+    y registra los valores repetidos para no tomar en silencio el primero.
+    """
+    indice = {'duplicados': {}}
+    for col in COLUMNAS_INDEXADAS:
+        valores = inventario_df[col].astype(str)
+        primeros = ~valores.duplicated()
+        indice[col] = dict(zip(valores[primeros].tolist(), inventario_df.index[primeros].tolist()))
+        indice['duplicados'][col] = set(valores[~primeros].tolist())
+    return indice
+
+@st.cache_resource
+def _indices_compartidos():
+    """Últimos índices del inventario armados en el proceso, con la versión de filas de la que salieron (los usan todas las sesiones)."""
+    return {'lock': threading.Lock()}
+
+def _obtener_indice(inventario_df, tipo, construir):
+    """
+    Devuelve un índice del inventario reconstruyéndolo solo si cambiaron sus filas (attrs['version'] de
+    read_sheet_to_df), no en cada recarga del DataFrame ni cuando cambia el stock.
+    """
+    version = inventario_df.attrs.get('version')
+    if version is None:
+        return construir(inventario_df)
+    compartidos = _indices_compartidos()
+    with compartidos['lock']:
+        guardado = compartidos.get(tipo)
+        if guardado is None or guardado[0] != version:
+            guardado = compartidos[tipo] = (version, construir(inventario_df))
+        return guardado[1]
+
+def obtener_indice_inventario(inventario_df):
+    """Devuelve los índices hash del inventario actual (ver _obtener_indice)."""
+    return _obtener_indice(inventario_df, 'inventario', construir_indice_inventario)
+
+def ubicar_producto(inventario_df, columna, valor):
+    """
+    Devuelve la etiqueta de fila del producto con ese valor en la columna indexada.
+    Devuelve None si no existe y lanza ValueError si hay más de un producto con ese valor.
+    """
+    indice = obtener_indice_inventario(inventario_df)
+    valor = str(valor)
+    if valor in indice['duplicados'][columna]:
+        raise ValueError(f"Hay más de un producto con {columna} = '{valor}'. Corrija el inventario antes de continuar.")
+    return indice[columna].get(valor)
+
+
+def _trigramas(texto):
+    """Conjunto de trigramas (subcadenas de 3 letras) de un texto ya normalizado."""
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def construir_indice_busqueda(inventario_df):
+    """
+    Normaliza una sola vez nombres y SKUs del inventario y arma un índice invertido de trigramas
+    (trigrama -> arreglo ordenado con las posiciones de los productos que lo contienen).
+    """
+    nombres = inventario_df['NOMBRE_PRODUCTO'].astype(str).tolist()
+    nombres_norm = [clean_input(nombre) for nombre in nombres]
+    skus_norm = [clean_input(sku) for sku in inventario_df['CODIGO_SKU'].astype(str).tolist()]
+
+    trigramas = {}
+    cantidades = []
+    for i, (nombre, sku) in enumerate(zip(nombres_norm, skus_norm)):
+        propios = _trigramas(nombre) | _trigramas(sku)
+        cantidades.append(len(propios))
+        for trigrama in propios:
+            trigramas.setdefault(trigrama, set()).add(i)
+
+    return {
+        'nombres': nombres,
+        'nombres_norm': nombres_norm,
+        'skus_norm': skus_norm,
+        # Arreglos de numpy: las intersecciones y conteos se hacen en bloque, sin recorrer en Python
+        'trigramas': {t: np.array(sorted(posiciones), dtype=np.int32) for t, posiciones in trigramas.items()},
+        'cantidades': np.array(cantidades, dtype=np.int32)
+    }
+
+def obtener_indice_busqueda(inventario_df):
+    """Devuelve el índice de búsqueda del inventario actual (ver _obtener_indice)."""
+    return _obtener_indice(inventario_df, 'busqueda', construir_indice_busqueda)
+
+def buscar_parecidos(indice, buscado, limite=LIMITE_SUGERENCIAS):
+    """
+    Búsqueda tolerante a errores de tipeo: cuenta cuántos trigramas de la búsqueda tiene cada producto
+    juntando solo las listas del índice invertido (nunca compara texto contra todo el catálogo).
+    Devuelve las posiciones de los productos más parecidos, de mayor a menor similitud.
+    """
+    propios = _trigramas(buscado)
+    listas = [indice['trigramas'][t] for t in propios if t in indice['trigramas']]
+    if len(propios) < 2 or not listas:
+        return []
+
+    cantidades = indice['cantidades']
+    conteo = np.bincount(np.concatenate(listas), minlength=len(cantidades))
+    candidatos = np.flatnonzero(conteo >= SIMILITUD_MINIMA * len(propios))
+    comunes = conteo[candidatos]
+    similitud = comunes / (len(propios) + cantidades[candidatos] - comunes)
+
+    # Primero cuántos trigramas de la búsqueda aparecen; a igualdad, el producto con menos trigramas sobrantes
+    orden = np.lexsort((candidatos, -similitud, -comunes))[:limite]
+    return candidatos[orden].tolist()
+
+def buscar_productos(indice, texto, limite=LIMITE_SUGERENCIAS):
+    """
+    Busca el texto (sin tildes ni mayúsculas) en nombres y SKUs del índice.
+    Devuelve (posiciones, total de coincidencias, aproximado), con las posiciones ordenadas por
+    relevancia: SKU exacto, luego empieza por el texto, luego lo contiene. Si no hay ninguna
+    coincidencia exacta, devuelve los productos más parecidos y aproximado=True.
+    """
+    buscado = clean_input(texto)
+    if not buscado:
+        return [], 0, False
+
+    if len(buscado) >= 3:
+        # Intersección de los trigramas de la búsqueda, empezando por el menos frecuente
+        vacio = np.array([], dtype=np.int32)
+        listas = sorted((indice['trigramas'].get(t, vacio) for t in _trigramas(buscado)), key=len)
+        candidatos = listas[0]
+        for lista in listas[1:]:
+            if len(candidatos) == 0:
+                break
+            candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+        candidatos = candidatos.tolist()
+    else:
+        candidatos = range(len(indice['nombres']))
+
+    nombres_norm, skus_norm = indice['nombres_norm'], indice['skus_norm']
+    encontrados = []
+    for i in candidatos:
+        nombre, sku = nombres_norm[i], skus_norm[i]
+        # Los trigramas pueden coincidir en distinto orden: confirmamos la subcadena completa
+        if buscado not in nombre and buscado not in sku:
+            continue
+        if sku == buscado:
+            rango = 0
+        elif nombre.startswith(buscado) or sku.startswith(buscado):
+            rango = 1
+        else:
+            rango = 2
+        encontrados.append((rango, i))
+
+    if not encontrados:
+        parecidos = buscar_parecidos(indice, buscado, limite)
+        return parecidos, len(parecidos), True
+
+    mejores = heapq.nsmallest(limite, encontrados) if limite else sorted(encontrados)
+    return [i for _, i in mejores], len(encontrados), False
+
+# --------------------------------------------------------------------
+# ALMACÉN DE VENTAS (SOLO AGREGA AL FINAL)
+# --------------------------------------------------------------------
+
+# Arreglo de numpy con que el almacén guarda cada tipo del esquema (las categorías, como códigos)
+TIPOS_ALMACEN = {'texto': object, 'categoria': 'int32', 'cantidad': 'int32', 'dinero': 'int64', 'fecha': 'datetime64[s]'}
+
+def dias_de(fechas):
+    """Día ('YYYY-MM-DD') de cada fecha; '' para las que no tienen fecha válida."""
+    dias = np.asarray(fechas, dtype='datetime64[s]').astype('datetime64[D]').astype(str)
+    dias[dias == 'NaT'] = ''
+    return dias
+
+def agrupar_ventas(ventas_df):
+    """Totales de RESUMEN_TOTALES por cada combinación de RESUMEN_CLAVES: {clave: [totales]} (ventas_df ya con tipos)."""
+    if ventas_df.empty:
+        return {}
+    tabla = pd.DataFrame({'DIA': dias_de(ventas_df['FECHA_HORA'])})
+    for col in RESUMEN_CLAVES[1:]:
+        tabla[col] = ventas_df[col].to_numpy(dtype=object)
+    tabla[RESUMEN_CLAVES[1:]] = tabla[RESUMEN_CLAVES[1:]].fillna('').astype(str)
+    tabla['VENTAS'] = 1
+    for col in RESUMEN_TOTALES[1:]:
+        tabla[col] = ventas_df[col].to_numpy(dtype='int64')
+    sumas = tabla.groupby(RESUMEN_CLAVES, sort=False).sum()
+    return {clave: valores.tolist() for clave, valores in zip(sumas.index, sumas[RESUMEN_TOTALES].to_numpy(dtype='int64'))}
+
+def sumar_resumen(resumen, otros):
+    """Suma (en el lugar) los totales de otro resumen."""
+    for clave, valores in otros.items():
+        actuales = resumen.get(clave)
+        if actuales is None:
+            resumen[clave] = list(valores)
+        else:
+            for i, valor in enumerate(valores):
+                actuales[i] += valor
+
+def ventas_desde_filas(encabezado, filas):
+    """DataFrame de ventas con sus tipos a partir de filas de texto de la hoja (las que lee leer_ventas_desde)."""
+    return tipar_ventas(_df_desde_snapshot([encabezado] + list(filas), VENTAS_COLS))
+
+def resumen_actual():
+    """
+    Resumen de todas las ventas (copia local y cola) sin recorrer el historial: parte del resumen guardado
+    y agrupa solo las filas que la copia sumó desde entonces (y las guarda) más las ventas en cola
+    (que no se guardan: todavía pueden cambiar). Si la copia se reemplazó, se vuelve a resumir entera.
+    """
+    guardado = leer_resumen()
+    lectura = leer_ventas_desde(guardado['filas'])
+    k = list(lectura['encabezado']).index('ID_VENTA')
+    # Solo se continúa un resumen si la copia siguió creciendo al final desde que se guardó
+    continua = (
+        lectura['era'] == guardado['era'] and guardado['filas'] <= lectura['filas_copia']
+        and (guardado['filas'] == 0 or str(lectura['anterior'][k]) == guardado['ultimo_id'])
+    )
+    if continua:
+        resumen = guardado['totales']
+    else:
+        lectura = leer_ventas_desde(0)
+        resumen = {}
+
+    nuevas = lectura['nuevas']
+    if nuevas or not continua:
+        nuevos = agrupar_ventas(ventas_desde_filas(lectura['encabezado'], nuevas))
+        hasta = (lectura['filas_copia'], str(nuevas[-1][k]) if nuevas else (guardado['ultimo_id'] if continua else None))
+        guardar_resumen(lectura['era'], (guardado['filas'], guardado['ultimo_id']), hasta, nuevos, reemplazar=not continua)
+        sumar_resumen(resumen, nuevos)
+    sumar_resumen(resumen, agrupar_ventas(ventas_desde_filas(lectura['encabezado'], lectura['cola'])))
+    return resumen
+
+def tabla_resumen(resumen, desde=None, hasta=None):
+    """
+    Filas del resumen (RESUMEN_CLAVES + RESUMEN_TOTALES) de los días completos desde <= día < hasta.
+    Con algún límite, las ventas sin fecha válida quedan afuera (igual que en AlmacenVentas.rango).
+    """
+    tabla = pd.DataFrame([clave + tuple(valores) for clave, valores in resumen.items()], columns=RESUMEN_CLAVES + RESUMEN_TOTALES)
+    tabla[RESUMEN_TOTALES] = tabla[RESUMEN_TOTALES].astype('int64')
+    if desde is not None or hasta is not None:
+        dias = tabla['DIA']
+        incluidas = dias != ''
+        if desde is not None:
+            incluidas &= dias >= desde.strftime('%Y-%m-%d')
+        if hasta is not None:
+            incluidas &= dias < hasta.strftime('%Y-%m-%d')
+        tabla = tabla[incluidas]
+    return tabla
+
+def inicio_periodo(periodo, ahora=None):
+    """Fecha y hora desde la que cuenta un período de reportes ('Todo' = sin límite)."""
+    ahora = ahora or datetime.now()
+    hoy = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+    if periodo == 'Hoy':
+        return hoy
+    if periodo == 'Esta semana':
+        return hoy - timedelta(days=hoy.weekday()) # desde el lunes
+    if periodo == 'Este mes':
+        return hoy.replace(day=1)
+    return None
+
+
+def _como_ventas(ventas_df):
+    """Filas de un DataFrame de ventas con tipos, como dicts para AlmacenVentas.agregar."""
+    columnas = [ventas_df[col].to_numpy() for col in VENTAS_COLS]
+    return [dict(zip(VENTAS_COLS, valores)) for valores in zip(*columnas)]
+
+
+class AlmacenVentas:
+    """
+    Historial de ventas en columnas de numpy con capacidad de sobra, de la más antigua a la más reciente.
+    Registrar una venta escribe una fila al final sin copiar el historial ni perder los tipos;
+    el orden 'más recientes primero' se arma solo al mostrar.
+    Las columnas 'categoria' del esquema guardan un código por venta y la lista de valores distintos.
+    Las ventas se mantienen ordenadas por FECHA_HORA: los períodos (hoy, semana, mes) se ubican
+    con búsqueda binaria en vez de recorrer todo el historial.
+    Las ventas nuevas de la copia local y de la cola se incorporan con sincronizar, sin recargar todo.
+    """
+
+    def __init__(self, ventas_df, filas_copia=0, era=None, en_cola=()):
+        n = len(ventas_df)
+        capacidad = max(64, n + n // 2)
+        self._columnas = {}
+        self._categorias = {}
+        for col in VENTAS_COLS:
+            arreglo = np.empty(capacidad, dtype=TIPOS_ALMACEN[ESQUEMA_VENTAS[col]])
+            if ESQUEMA_VENTAS[col] == 'categoria':
+                categorica = ventas_df[col].astype('category')
+                self._categorias[col] = list(categorica.cat.categories)
+                arreglo[:n] = categorica.cat.codes.to_numpy()
+            else:
+                arreglo[:n] = ventas_df[col].to_numpy(dtype=arreglo.dtype)
+            self._columnas[col] = arreglo
+        # Código de cada valor ya visto, para agregar en O(1)
+        self._codigos = {col: {valor: i for i, valor in enumerate(valores)} for col, valores in self._categorias.items()}
+        self._n = n
+        # Bytes del contenido de los textos (columnas 'texto' y valores de las categorías): se suman al agregar, no se recorren
+        self._bytes_textos = sum(
+            sum(sys.getsizeof(v) for v in arreglo[:n]) for arreglo in self._columnas.values() if arreglo.dtype == object
+        ) + sum(sys.getsizeof(v) for valores in self._categorias.values() for v in valores)
+        # Se pierde solo si llega una venta con fecha anterior a la última (ej: reloj atrasado); se reordena al consultar.
+        # Las ventas sin fecha válida (NaT) van al final, después de todas las fechadas: se cuentan aparte
+        sin_fecha = np.isnat(self._columnas['FECHA_HORA'][:n])
+        self._sin_fecha = int(sin_fecha.sum())
+        fechadas = self._columnas['FECHA_HORA'][:n - self._sin_fecha]
+        self._ordenado = not sin_fecha[:n - self._sin_fecha].any() and bool(np.all(np.diff(fechadas) >= np.timedelta64(0, 's')))
+        # Hasta qué fila de la copia local de Ventas (de qué era) está incluida, y los ID_VENTA incluidos
+        # que todavía no llegaron a la copia (ventas en cola): al llegar no se vuelven a agregar
+        self._filas_copia = filas_copia
+        self._era = era
+        self._en_cola = set(en_cola)
+
+    def __len__(self):
+        return self._n
+
+    def agregar(self, venta, en_cola=True):
+        """
+        Agrega una venta (dict con las columnas de VENTAS_COLS) al final, en O(1) amortizado.
+        en_cola=False para las que ya vienen de la copia local de la hoja.
+        """
+        if self._n == len(self._columnas[VENTAS_COLS[0]]):
+            # Sin lugar: duplicamos la capacidad (la copia se reparte entre muchas ventas)
+            for col, arreglo in self._columnas.items():
+                nuevo = np.empty(2 * len(arreglo), dtype=arreglo.dtype)
+                nuevo[:self._n] = arreglo[:self._n]
+                self._columnas[col] = nuevo
+        for col in VENTAS_COLS:
+            valor = venta[col]
+            if col in self._codigos:
+                if valor not in self._codigos[col]:
+                    self._codigos[col][valor] = len(self._categorias[col])
+                    self._categorias[col].append(valor)
+                    self._bytes_textos += sys.getsizeof(valor)
+                valor = self._codigos[col][valor]
+            elif ESQUEMA_VENTAS[col] == 'texto':
+                self._bytes_textos += sys.getsizeof(valor)
+            self._columnas[col][self._n] = valor
+        self._ubicar_ultima()
+        if en_cola:
+            self._en_cola.add(str(venta['ID_VENTA']))
+        self._n += 1
+
+    def _ubicar_ultima(self):
+        """Mantiene el orden con la venta recién escrita en la posición _n: sin fecha, queda al final; con fecha, antes de las sin fecha."""
+        if not self._ordenado:
+            return
+        fechas = self._columnas['FECHA_HORA']
+        if np.isnat(fechas[self._n]):
+            self._sin_fecha += 1
+            return
+        ultima = self._n - self._sin_fecha - 1 # última venta con fecha
+        if ultima >= 0 and fechas[self._n] < fechas[ultima]:
+            self._ordenado = False
+        elif self._sin_fecha:
+            # Intercambia la nueva con la primera sin fecha (O(1): no se mueve el resto del historial)
+            i, j = ultima + 1, self._n
+            for arreglo in self._columnas.values():
+                arreglo[i], arreglo[j] = arreglo[j], arreglo[i]
+
+    def sincronizar(self):
+        """
+        Agrega las ventas que la copia local y la cola sumaron desde la carga (de otros vendedores o sesiones),
+        leyendo solo esas filas. Devuelve False si la copia se reemplazó: hay que volver a cargar con cargar_ventas.
+        """
+        if self._era is None:
+            return False
+        lectura = leer_ventas_desde(self._filas_copia)
+        if lectura['era'] != self._era:
+            return False
+        for venta in _como_ventas(ventas_desde_filas(lectura['encabezado'], lectura['nuevas'])):
+            if str(venta['ID_VENTA']) in self._en_cola:
+                self._en_cola.discard(str(venta['ID_VENTA'])) # Ya estaba: se registró en esta sesión
+            else:
+                self.agregar(venta, en_cola=False)
+        self._filas_copia = lectura['filas_copia']
+        for venta in _como_ventas(ventas_desde_filas(lectura['encabezado'], lectura['cola'])):
+            if str(venta['ID_VENTA']) not in self._en_cola:
+                self.agregar(venta)
+        return True
+
+    def _ordenar(self):
+        """Reordena por FECHA_HORA (orden estable) si alguna venta llegó fuera de orden."""
+        if self._ordenado:
+            return
+        orden = np.argsort(self._columnas['FECHA_HORA'][:self._n], kind='stable')
+        for arreglo in self._columnas.values():
+            arreglo[:self._n] = arreglo[:self._n][orden]
+        self._sin_fecha = int(np.isnat(self._columnas['FECHA_HORA'][:self._n]).sum())
+        self._ordenado = True
+
+    def rango(self, desde=None, hasta=None):
+        """Posiciones [inicio, fin) de las ventas con desde <= FECHA_HORA < hasta (None = sin límite), en O(log n)."""
+        self._ordenar()
+        fechas = self._columnas['FECHA_HORA'][:self._n]
+        if desde is None and hasta is None:
+            return 0, self._n
+        # Las ventas sin fecha válida (NaT) quedan al final del orden y no entran en ningún período
+        inicio = 0 if desde is None else int(np.searchsorted(fechas, np.datetime64(desde, 's'), side='left'))
+        fin = np.datetime64('NaT') if hasta is None else np.datetime64(hasta, 's')
+        return inicio, int(np.searchsorted(fechas, fin, side='left'))
+
+    def _serie(self, col, arreglo):
+        """Arma la columna del DataFrame con su tipo del esquema (las categorías, a partir de sus códigos)."""
+        if col in self._categorias:
+            return pd.Categorical.from_codes(arreglo, categories=self._categorias[col])
+        return pd.array(arreglo, dtype=DTYPES_ESQUEMA[ESQUEMA_VENTAS[col]]) if ESQUEMA_VENTAS[col] == 'texto' else arreglo
+
+    def recientes(self, cantidad, desde=None, hasta=None):
+        """DataFrame con las últimas ventas (opcionalmente de un período), las más recientes primero."""
+        primera, fin = self.rango(desde, hasta)
+        inicio = max(primera, fin - cantidad)
+        return pd.DataFrame({col: self._serie(col, self._columnas[col][inicio:fin][::-1]) for col in VENTAS_COLS})
+
+    def memoria_mb(self):
+        """Memoria ocupada por las ventas cargadas (códigos, números y el contenido de los textos), en MB, sin recorrerlas."""
+        return (sum(arreglo.itemsize for arreglo in self._columnas.values()) * self._n + self._bytes_textos) / 1e6
+
+# --------------------------------------------------------------------
+# COLA DE ESCRITURA (ENVÍO EN SEGUNDO PLANO)
+# --------------------------------------------------------------------
+# Las ventas y los cambios de inventario se guardan primero en la cola local (SQLite) y la
+# pantalla sigue de inmediato. Un hilo los envía a Google Sheets en orden, agrupando los
+# consecutivos, y reintenta con espera creciente si la API falla. Hasta que se envían, las
+# lecturas los aplican sobre la copia local.
+
+def leer_pendientes(estado='pendiente'):
+    """Devuelve los cambios encolados en un estado, en orden de llegada."""
+    cache = _cache_local()
+    with cache['lock']:
+        filas = cache['conexion'].execute(
+            "SELECT id, tipo, carga, intentos, detalle FROM pendientes WHERE estado = ? ORDER BY id", (estado,)
+        ).fetchall()
+    return [
+        {'id': id_pendiente, 'tipo': tipo, 'carga': json.loads(carga), 'intentos': intentos, 'detalle': detalle}
+        for id_pendiente, tipo, carga, intentos, detalle in filas
+    ]
+
+def contar_pendientes():
+    """Cantidad de cambios encolados por estado (ej: {'pendiente': 3, 'conflicto': 1})."""
+    cache = _cache_local()
+    with cache['lock']:
+        return dict(cache['conexion'].execute("SELECT estado, COUNT(*) FROM pendientes GROUP BY estado").fetchall())
+
+def _actualizar_pendientes(ids, estado=None, detalle=None, carga=None, sumar_intento=False):
+    """Cambia el estado, el detalle, la carga o los intentos de uno o varios cambios encolados."""
+    cache = _cache_local()
+    with cache['lock'], cache['conexion'] as conexion:
+        for id_pendiente in ids:
+            if estado is not None:
+                conexion.execute("UPDATE pendientes SET estado = ? WHERE id = ?", (estado, id_pendiente))
+            if detalle is not None:
+                conexion.execute("UPDATE pendientes SET detalle = ? WHERE id = ?", (detalle, id_pendiente))
+            if carga is not None:
+                conexion.execute("UPDATE pendientes SET carga = ? WHERE id = ?", (json.dumps(carga[id_pendiente]), id_pendiente))
+            if sumar_intento:
+                conexion.execute("UPDATE pendientes SET intentos = intentos + 1 WHERE id = ?", (id_pendiente,))
+
+def borrar_pendientes(ids):
+    """Quita de la cola cambios ya enviados (o descartados)."""
+    cache = _cache_local()
+    with cache['lock'], cache['conexion'] as conexion:
+        conexion.executemany("DELETE FROM pendientes WHERE id = ?", ((id_pendiente,) for id_pendiente in ids))
+
+def encolar(tipo, carga):
+    """Guarda un cambio en la cola local (sobrevive a los reinicios) y despierta al hilo de envío."""
+    cache = _cache_local()
+    with cache['lock'], cache['conexion'] as conexion:
+        conexion.execute("INSERT INTO pendientes (tipo, carga, creado) VALUES (?, ?, ?)", (tipo, json.dumps(carga), time.time()))
+    _escritor()['despertar'].set()
+    # Las lecturas cacheadas todavía no incluyen el cambio nuevo
+    st.cache_data.clear()
+
+def encolar_ventas(inventario_df, ventas_nuevas):
+    """Encola un ticket ya registrado localmente: sus filas de Ventas y las unidades a descontar de cada producto."""
+    descuentos = {}
+    for venta in ventas_nuevas:
+        etiqueta = ubicar_producto(inventario_df, 'NOMBRE_PRODUCTO', venta['NOMBRE_PRODUCTO_VENDIDO'])
+        id_producto = str(inventario_df.loc[etiqueta, 'ID_PRODUCTO'])
+        descuentos[id_producto] = descuentos.get(id_producto, 0) + int(venta['CANTIDAD_UNIDADES'])
+    # Mismo formato de texto con el que se escriben las hojas
+    filas = [[centavos_a_texto(v[c]) if ESQUEMA_VENTAS[c] == 'dinero' else str(v[c]) for c in VENTAS_COLS] for v in ventas_nuevas]
+    encolar('ventas', {'filas': filas, 'descuentos': descuentos})
+
+def alinear_filas(filas, columnas, encabezado):
+    """Pasa filas en el orden de 'columnas' (el de la app) al orden de columnas de la hoja ('encabezado')."""
+    posiciones = [columnas.index(c) if c in columnas else None for c in encabezado]
+    return [['' if j is None else fila[j] for j in posiciones] for fila in filas]
+
+def encabezado_hoja(sheet_name):
+    """Encabezado de una hoja según su copia local; el orden de columnas de la app si todavía está vacía."""
+    snapshot = leer_snapshot(sheet_name)
+    if snapshot is not None and any(snapshot['encabezado']):
+        return list(snapshot['encabezado'])
+    return list(INVENTARIO_COLS if sheet_name == INVENTARIO_SHEET_NAME else VENTAS_COLS)
+
+def columnas_hoja(encabezado, sheet_name, columnas):
+    """Números de columna (desde 1) de varias columnas en el encabezado de una hoja; ConflictoDeVersion si falta alguna."""
+    faltantes = [c for c in columnas if c not in encabezado]
+    if faltantes:
+        raise ConflictoDeVersion(f"La hoja '{sheet_name}' no tiene las columnas {', '.join(faltantes)}.")
+    return [encabezado.index(c) + 1 for c in columnas]
+
+def aplicar_pendiente(sheet_name, datos, tipo, carga):
+    """
+    Aplica un cambio encolado a las filas de una hoja (encabezado + filas, como la copia local)
+    y devuelve las filas resultantes, sin modificar las recibidas.
+    """
+    columnas = INVENTARIO_COLS if sheet_name == INVENTARIO_SHEET_NAME else VENTAS_COLS
+    encabezado = datos[0] if datos else columnas
+    filas = datos[1:]
+
+    # Las filas encoladas vienen en el orden de columnas de la app; la hoja puede tener otro
+    if tipo == 'ventas':
+        if sheet_name == VENTAS_SHEET_NAME:
+            return [encabezado] + filas + alinear_filas(carga['filas'], columnas, encabezado)
+        if carga.get('stock_descontado'):
+            return datos # El stock ya se descontó en el servidor y en la copia local
+        k = encabezado.index('ID_PRODUCTO')
+        j = encabezado.index('CANTIDAD_ACTUAL')
+        resultado = [encabezado]
+        for fila in filas:
+            unidades = carga['descuentos'].get(str(fila[k]))
+            if unidades:
+                fila = list(fila)
+                fila[j] = str(int(np.nan_to_num(numero_de_celda(fila[j]))) - unidades)
+            resultado.append(fila)
+        return resultado
+
+    if sheet_name != INVENTARIO_SHEET_NAME:
+        return datos
+    k = encabezado.index('NOMBRE_PRODUCTO')
+    if tipo == 'eliminar_producto':
+        return [encabezado] + [fila for fila in filas if str(fila[k]) != carga['nombre']]
+    if tipo == 'agregar_productos':
+        # Igual que drop_duplicates(keep='last'): un nombre repetido queda con su última fila
+        combinadas = filas + alinear_filas(carga['filas'], columnas, encabezado)
+        ultima = {str(fila[k]): i for i, fila in enumerate(combinadas)}
+        return [encabezado] + [fila for i, fila in enumerate(combinadas) if ultima[str(fila[k])] == i]
+    return datos
+
+def _leer_stock(inventario_ws, celdas):
+    """
+    Lee del servidor el valor sin formato de varias celdas de stock en una sola llamada.
+    Se interpretan igual que al cargar el inventario ('12.0' -> 12, '1,200' -> 1200); lo que no es un número cuenta 0.
+    """
+    valores = inventario_ws.batch_get(celdas, value_render_option='UNFORMATTED_VALUE')
+    return [int(np.nan_to_num(numero_de_celda(v[0][0]))) if v and v[0] else 0 for v in valores]
+
+def _hoja_cerrojo(spreadsheet):
+    """Worksheet del cerrojo del stock; la crea la primera vez que se necesita."""
+    try:
+        return obtener_hoja(spreadsheet, CERROJO_SHEET_NAME)
+    except gspread.exceptions.WorksheetNotFound:
+        olvidar_hojas()
+        try:
+            return spreadsheet.add_worksheet(CERROJO_SHEET_NAME, rows=1, cols=1)
+        except gspread.exceptions.APIError:
+            # Otro vendedor la creó al mismo tiempo
+            return obtener_hoja(spreadsheet, CERROJO_SHEET_NAME)
+
+def _leer_cerrojo(worksheet):
+    """Dueño actual del cerrojo ('' si está libre)."""
+    valores = worksheet.batch_get(['A1'])
+    return str(valores[0][0][0]) if valores and valores[0] and valores[0][0] else ''
+
+def tomar_cerrojo(spreadsheet, marca):
+    """
+    Toma el cerrojo del stock (algoritmo de Fischer sobre una celda): espera a que esté libre, escribe la marca,
+    espera ESPERA_CERROJO y confirma que la celda sigue con la marca (si dos escriben a la vez, gana el último).
+    Si entre leer la celda libre y escribirla pasó ESPERA_CERROJO o más, otro pudo tomarla en el medio: no se entra
+    y la marca escrita se deja vencer. Devuelve hasta cuándo (time.monotonic) se puede escribir con el cerrojo.
+    Lanza RuntimeError si no se consigue (se reintenta con la cola).
+    """
+    worksheet = _hoja_cerrojo(spreadsheet)
+    visto, desde = None, time.monotonic()
+    limite = time.monotonic() + 2 * VENCIMIENTO_CERROJO
+    while time.monotonic() < limite:
+        inicio = time.monotonic()
+        actual = _leer_cerrojo(worksheet)
+        if actual != visto:
+            visto, desde = actual, inicio
+        if actual and inicio - desde < VENCIMIENTO_CERROJO:
+            time.sleep(ESPERA_CERROJO * (0.5 + random.random() / 2))
+            continue
+        worksheet.batch_update([{'range': 'A1', 'values': [[marca]]}])
+        if time.monotonic() - inicio >= ESPERA_CERROJO:
+            continue
+        time.sleep(ESPERA_CERROJO)
+        if _leer_cerrojo(worksheet) == marca:
+            # Los demás lo dan por abandonado VENCIMIENTO_CERROJO después de verlo: queda margen para la última escritura
+            return inicio + VENCIMIENTO_CERROJO - 2 * ESPERA_CERROJO
+    raise RuntimeError("Otro vendedor está descontando stock al mismo tiempo.")
+
+def soltar_cerrojo(spreadsheet, marca):
+    """Libera el cerrojo del stock si sigue siendo nuestro."""
+    worksheet = _hoja_cerrojo(spreadsheet)
+    if _leer_cerrojo(worksheet) == marca:
+        worksheet.batch_update([{'range': 'A1', 'values': [['']]}])
+
+@contextmanager
+def cerrojo_stock(spreadsheet):
+    """Bloque con el cerrojo del stock tomado; entrega hasta cuándo (time.monotonic) se puede escribir con él."""
+    marca = uuid.uuid4().hex
+    vence = tomar_cerrojo(spreadsheet, marca)
+    try:
+        yield vence
+    finally:
+        try:
+            soltar_cerrojo(spreadsheet, marca)
+        except Exception:
+            pass # Si no se pudo liberar, los demás lo dan por abandonado al vencer
+
+def descontar_stock(inventario_ws, columna, descuentos, vence):
+    """
+    Descuenta stock directamente sobre las celdas CANTIDAD_ACTUAL del servidor ({fila: unidades}), con el cerrojo
+    del stock tomado: lee los valores actuales, verifica que alcancen y escribe los nuevos (confirmar con verificar_stock).
+    Nunca escribe un stock negativo: si no alcanza, lanza ConflictoDeVersion sin escribir nada.
+    columna es la de CANTIDAD_ACTUAL en la hoja. Con unidades negativas devuelve stock. Devuelve {fila: stock escrito}.
+    """
+    filas = list(descuentos)
+    celdas = [gspread.utils.rowcol_to_a1(fila, columna) for fila in filas]
+
+    actuales = _leer_stock(inventario_ws, celdas)
+    faltantes = [f"fila {fila}: quedan {actual}" for fila, actual in zip(filas, actuales) if actual < descuentos[fila]]
+    if faltantes:
+        raise ConflictoDeVersion(f"Stock insuficiente en la hoja ({', '.join(faltantes)}).")
+
+    if time.monotonic() > vence:
+        raise RuntimeError("El cerrojo del stock venció antes de escribir.")
+    nuevos = [actual - descuentos[fila] for fila, actual in zip(filas, actuales)]
+    inventario_ws.batch_update([{'range': celda, 'values': [[str(nuevo)]]} for celda, nuevo in zip(celdas, nuevos)])
+    return dict(zip(filas, nuevos))
+
+def verificar_stock(inventario_ws, columna, escritos):
+    """
+    Vuelve a leer las celdas de stock recién escritas ({fila: stock escrito}) de la columna CANTIDAD_ACTUAL.
+    Devuelve ({fila: stock que quedó en el servidor}, filas en las que alguien escribió encima).
+    """
+    filas = list(escritos)
+    # Con el cerrojo tomado ningún otro vendedor escribe stock: una diferencia es una edición a mano o de otro programa
+    verificados = _leer_stock(inventario_ws, [gspread.utils.rowcol_to_a1(fila, columna) for fila in filas])
+    modificadas = [fila for fila, verificado in zip(filas, verificados) if escritos[fila] != verificado]
+    return dict(zip(filas, verificados)), modificadas
+
+def descontar_y_verificar(inventario_ws, columna, descuentos, vence, anotar):
+    """
+    Descuenta stock ({fila: unidades}) con el cerrojo tomado y lo confirma releyendo las celdas. Si en una celda
+    alguien escribió encima de nuestro valor, ese descuento se perdió y se repite sobre el valor nuevo.
+    anotar(True) se llama apenas se escribe por primera vez (un reintento no vuelve a descontar).
+    Si el stock no alcanza en un reintento (o se agotan los intentos), devuelve lo ya descontado,
+    llama a anotar(False) y relanza. Devuelve {fila: stock que quedó}.
+    """
+    faltan = dict(descuentos)
+    stock = {}
+    escrito = False
+    try:
+        for intento in range(REINTENTOS_CONFLICTO):
+            escritos = descontar_stock(inventario_ws, columna, faltan, vence)
+            if not escrito:
+                escrito = True
+                anotar(True)
+            verificados, modificadas = verificar_stock(inventario_ws, columna, escritos)
+            stock.update({fila: valor for fila, valor in verificados.items() if fila not in modificadas})
+            faltan = {fila: faltan[fila] for fila in modificadas}
+            if not faltan:
+                return stock
+        raise RuntimeError("El stock se modificó a mano mientras se descontaba; se reintentará.")
+    except (ConflictoDeVersion, RuntimeError):
+        if stock:
+            descontar_stock(inventario_ws, columna, {fila: -descuentos[fila] for fila in stock}, vence)
+        if escrito:
+            anotar(False)
+        raise
+
+def _enviar_ventas(spreadsheet, pendientes):
+    """
+    Envía un grupo de tickets encolados: descuenta el stock de todos en el servidor (con el cerrojo del stock)
+    y agrega todas sus filas de Ventas en un solo append. Cada paso queda anotado en la cola, para que un reintento
+    no descuente dos veces ni duplique filas.
+    Lanza ConflictoDeVersion (sin escribir nada) si un producto ya no existe o no le alcanza el stock.
+    """
+    inventario_ws = obtener_hoja(spreadsheet, INVENTARIO_SHEET_NAME)
+    ventas_ws = obtener_hoja(spreadsheet, VENTAS_SHEET_NAME)
+    revision_previa = revision_actual(spreadsheet)
+    cache = _cache_local()
+
+    sin_descontar = [p for p in pendientes if not p['carga'].get('stock_descontado')]
+    if sin_descontar:
+        descuentos = {}
+        for pendiente in sin_descontar:
+            for id_producto, unidades in pendiente['carga']['descuentos'].items():
+                descuentos[id_producto] = descuentos.get(id_producto, 0) + unidades
+
+        def copiar_stock(stock):
+            # La copia local toma el stock del servidor
+            datos = leer_filas(INVENTARIO_SHEET_NAME)
+            if datos:
+                k = datos[0].index('ID_PRODUCTO')
+                j = datos[0].index('CANTIDAD_ACTUAL')
+                for i, fila in enumerate(datos[1:], start=1):
+                    fila_hoja = fila_por_id.get(str(fila[k]))
+                    if fila_hoja in stock:
+                        actualizar_celda_snapshot(INVENTARIO_SHEET_NAME, i, j, str(stock[fila_hoja]))
+
+        def anotar(descontado):
+            # Se anota apenas se escribió (antes de cualquier otra llamada que pueda fallar): un reintento no vuelve a descontar
+            with cache['lock']:
+                for pendiente in sin_descontar:
+                    pendiente['carga']['stock_descontado'] = descontado
+                _actualizar_pendientes([p['id'] for p in sin_descontar], carga={p['id']: p['carga'] for p in sin_descontar})
+
+        # Con el cerrojo tomado ningún otro vendedor escribe stock entre nuestra lectura y nuestra escritura
+        with cerrojo_stock(spreadsheet) as vence:
+            # Las columnas según el encabezado de la hoja (puede tener otro orden que el de la app)
+            columna_id, columna_stock = columnas_hoja(encabezado_hoja(INVENTARIO_SHEET_NAME), INVENTARIO_SHEET_NAME, ['ID_PRODUCTO', 'CANTIDAD_ACTUAL'])
+            # Ubicamos las filas de los productos leyendo solo la columna de IDs (no depende del historial de ventas)
+            ids = inventario_ws.col_values(columna_id)
+            fila_por_id = {id_producto: i + 1 for i, id_producto in enumerate(ids)}
+            faltantes = [id_producto for id_producto in descuentos if id_producto not in fila_por_id]
+            if faltantes:
+                raise ConflictoDeVersion(f"Productos que ya no están en el inventario: {', '.join(faltantes)}.")
+
+            # El stock se descuenta sobre el valor actual de cada celda en el servidor, no sobre la copia local
+            filas = {fila_por_id[i]: u for i, u in descuentos.items()}
+            try:
+                stock = descontar_y_verificar(inventario_ws, columna_stock, filas, vence, anotar)
+            except (ConflictoDeVersion, RuntimeError):
+                raise
+            except Exception as e:
+                if not sin_descontar[0]['carga'].get('stock_descontado'):
+                    raise
+                # El descuento ya está escrito; sin la confirmación solo se avisa
+                cache['avisos'].append(f"No se pudo confirmar el stock descontado ({e}). Revise las cantidades en el inventario.")
+                stock = {}
+        with cache['lock']:
+            copiar_stock(stock)
+        _registrar_envio(INVENTARIO_SHEET_NAME, len(filas), len(filas))
+
+    # Las filas encoladas están en el orden de la app: se escriben en el de la hoja (que debe tener todas las columnas)
+    encabezado = encabezado_hoja(VENTAS_SHEET_NAME)
+    columnas_hoja(encabezado, VENTAS_SHEET_NAME, VENTAS_COLS)
+    k = encabezado.index('ID_VENTA')
+    filas_venta = alinear_filas([fila for pendiente in pendientes for fila in pendiente['carga']['filas']], VENTAS_COLS, encabezado)
+    if any(p['intentos'] or p['carga'].get('filas_en_envio') for p in pendientes):
+        # Un envío anterior (o el proceso) pudo cortarse después del append: no repetimos las ventas que ya están
+        existentes = set(ventas_ws.col_values(k + 1))
+        filas_venta = [fila for fila in filas_venta if fila[k] not in existentes]
+    # La copia local se puede adoptar como revisión nueva solo si nuestras filas quedaron justo después de las suyas
+    contigua = True
+    if filas_venta:
+        # Se anota antes del append: si el proceso se corta justo después, el próximo envío busca las que ya están
+        with cache['lock']:
+            for pendiente in pendientes:
+                pendiente['carga']['filas_en_envio'] = True
+            _actualizar_pendientes([p['id'] for p in pendientes], carga={p['id']: p['carga'] for p in pendientes})
+        respuesta = ventas_ws.append_rows(filas_venta)
+        rango = respuesta['updates']['updatedRange'].split('!')[-1].split(':')[0]
+        snapshot = leer_snapshot(VENTAS_SHEET_NAME)
+        contigua = snapshot is not None and gspread.utils.a1_to_rowcol(rango)[0] == snapshot['filas'] + 1
+
+    with cache['lock']:
+        agregar_filas_snapshot(VENTAS_SHEET_NAME, filas_venta)
+        borrar_pendientes([p['id'] for p in pendientes])
+        # El append agranda la grilla en el servidor si hace falta
+        snapshot = leer_snapshot(VENTAS_SHEET_NAME)
+        if snapshot is not None:
+            _ajustar_grilla(ventas_ws, snapshot['filas'])
+    if contigua:
+        confirmar_revision(spreadsheet, revision_previa)
+    _registrar_envio(VENTAS_SHEET_NAME, len(filas_venta) * len(VENTAS_COLS), len(filas_venta) * len(VENTAS_COLS))
+
+def _enviar_inventario(spreadsheet, pendientes):
+    """
+    Envía un grupo de cambios de inventario encolados con control de concurrencia optimista:
+    los aplica sobre la última versión de la hoja y escribe solo si nadie escribió desde esa revisión;
+    si otro vendedor se adelantó, vuelve a aplicarlos sobre los datos nuevos.
+    Escribe con el cerrojo del stock tomado: la hoja reescrita no pisa un descuento de stock hecho en el medio.
+    """
+    for intento in range(REINTENTOS_CONFLICTO):
+        with cerrojo_stock(spreadsheet) as vence:
+            revision = fecha_modificacion(spreadsheet)
+            descargar_hoja(spreadsheet, INVENTARIO_SHEET_NAME, revision)
+            datos = leer_filas(INVENTARIO_SHEET_NAME)
+            for pendiente in pendientes:
+                datos = aplicar_pendiente(INVENTARIO_SHEET_NAME, datos, pendiente['tipo'], pendiente['carga'])
+
+            # Texto en el orden de columnas de la app, como lo escribe la hoja
+            encabezado = datos[0]
+            data_to_write = [INVENTARIO_COLS] + [
+                [str(valores.get(c, '')) for c in INVENTARIO_COLS]
+                for valores in (dict(zip(encabezado, fila)) for fila in datos[1:])
+            ]
+            try:
+                verificar_revision(spreadsheet, revision)
+                if time.monotonic() > vence:
+                    raise ConflictoDeVersion("El cerrojo del stock venció antes de escribir.")
+            except ConflictoDeVersion:
+                conflicto = True
+            else:
+                conflicto = False
+                escribir_hoja(spreadsheet, INVENTARIO_SHEET_NAME, data_to_write)
+                with _cache_local()['lock']:
+                    borrar_pendientes([p['id'] for p in pendientes])
+        if conflicto:
+            # Espera creciente con algo de azar para no chocar otra vez con el mismo vendedor
+            time.sleep((intento + 1) * 0.5 + random.random() * 0.5)
+            continue
+        confirmar_revision(spreadsheet, revision)
+        return
+
+    raise RuntimeError("Otro vendedor está guardando cambios al mismo tiempo.")
+
+def _enviar_grupo_ventas(spreadsheet, pendientes):
+    """Envía un grupo de tickets; si alguno choca con el stock del servidor, los separa para aislarlo."""
+    try:
+        _enviar_ventas(spreadsheet, pendientes)
+    except ConflictoDeVersion as e:
+        if len(pendientes) > 1:
+            for pendiente in pendientes:
+                _enviar_grupo_ventas(spreadsheet, [pendiente])
+        else:
+            # No se reintenta solo: queda a la vista en el menú lateral para decidir qué hacer
+            _actualizar_pendientes([pendientes[0]['id']], estado='conflicto', detalle=str(e))
+
+def vaciar_cola(spreadsheet):
+    """
+    Envía en orden los cambios pendientes, agrupando los consecutivos del mismo tipo (ventas o inventario).
+    Termina cuando la cola queda vacía; si un envío falla, anota el error en sus cambios y lo relanza.
+    """
+    cache = _cache_local()
+    while True:
+        pendientes = leer_pendientes()
+        if not pendientes:
+            return
+        es_venta = pendientes[0]['tipo'] == 'ventas'
+        grupo = []
+        for pendiente in pendientes[:LOTE_MAXIMO_COLA]:
+            if (pendiente['tipo'] == 'ventas') != es_venta:
+                break
+            grupo.append(pendiente)
+
+        try:
+            with cache['escritura']:
+                if es_venta:
+                    _enviar_grupo_ventas(spreadsheet, grupo)
+                else:
+                    _enviar_inventario(spreadsheet, grupo)
+        except Exception as e:
+            _actualizar_pendientes([p['id'] for p in grupo], detalle=str(e), sumar_intento=True)
+            if not _es_error_transitorio(e):
+                olvidar_hojas() # Puede ser una hoja renombrada o con otro tamaño: se piden de nuevo
+            raise
+
+def _es_error_transitorio(error):
+    """Límite de cuota (429), error del servidor (5xx) o falla de red: conviene reintentar pronto."""
+    codigo = getattr(error, 'code', None)
+    return not isinstance(codigo, int) or codigo == 429 or codigo >= 500
+
+@st.cache_resource
+def _escritor():
+    """Hilo único (por proceso) que vacía la cola de escritura en segundo plano."""
+    estado = {
+        'spreadsheet': None, 'despertar': threading.Event(), 'error': None, 'reintento': 0.0,
+        'reintentar_ya': threading.Event()
+    }
+
+    def bucle():
+        fallos = 0
+        while True:
+            restante = estado['reintento'] - time.time()
+            if restante > 0:
+                # Un cambio nuevo no adelanta la espera tras un error; el botón "Reintentar ahora" sí
+                estado['reintentar_ya'].wait(restante)
+                estado['reintentar_ya'].clear()
+            else:
+                estado['despertar'].wait(REVISION_COLA_SEGUNDOS)
+            estado['despertar'].clear()
+            if estado['spreadsheet'] is None:
+                continue
+            try:
+                vaciar_cola(estado['spreadsheet'])
+                fallos = 0
+                estado['error'] = None
+                estado['reintento'] = 0.0
+            except Exception as e:
+                # Espera exponencial con azar; los errores no transitorios (ej: permisos) se espacian más
+                fallos += 1
+                base = 1 if _es_error_transitorio(e) else 30
+                espera = min(base * 2 ** fallos, ESPERA_MAXIMA_SEGUNDOS) * (0.5 + random.random() / 2)
+                estado['error'] = str(e)
+                estado['reintento'] = time.time() + espera
+
+    threading.Thread(target=bucle, daemon=True).start()
+    return estado
+
+def iniciar_escritor(spreadsheet):
+    """
+    Entrega la conexión al hilo de envío. Al llegar una conexión nueva (arranque o vuelta de la señal)
+    lo despierta sin esperar el turno de reintento, para enviar lo que quedó en la cola.
+    """
+    estado = _escritor()
+    if estado['spreadsheet'] is not spreadsheet:
+        estado['spreadsheet'] = spreadsheet
+        reintentar_envio()
+
+def reintentar_envio():
+    """Cancela la espera tras un error y pide al hilo que envíe la cola ahora."""
+    estado = _escritor()
+    estado['reintento'] = 0.0
+    estado['despertar'].set()
+    estado['reintentar_ya'].set()
+
 # --------------------------------------------------------------------
 # LÓGICA DE CARGA Y GUARDADO
 # --------------------------------------------------------------------
 
-def load_data():
-    """Carga los datos desde Google Sheets y aplica la limpieza de tipos."""
-    
-    # Intenta leer los datos (usa cache)
+def cargar_inventario():
+    """
+    Carga el inventario (copia local más la cola) y aplica la limpieza de tipos.
+    La hoja llega como texto: las columnas numéricas se convierten acá una sola vez y el resto queda como texto.
+    Es lo que se recarga antes de cada venta: su costo depende del catálogo, no del historial de ventas.
+    """
     inventario_df = read_sheet_to_df(INVENTARIO_SHEET_NAME, INVENTARIO_COLS)
-    ventas_df = read_sheet_to_df(VENTAS_SHEET_NAME, VENTAS_COLS)
 
     if not inventario_df.empty:
         # Limpieza de tipos y manejo de valores numéricos para Inventario
-        inventario_df['CANTIDAD_ACTUAL'] = pd.to_numeric(inventario_df['CANTIDAD_ACTUAL'], errors='coerce').fillna(0).astype(int)
+        inventario_df['CANTIDAD_ACTUAL'] = pd.Series(numerizar_texto_series(inventario_df['CANTIDAD_ACTUAL'])[0], index=inventario_df.index).fillna(0).astype(int)
         for col in ['COSTO_UNITARIO', 'PRECIO_BASE', 'PRECIO_PUBLICO']:
-            inventario_df[col] = inventario_df[col].apply(parse_price)
-            
+            inventario_df[col] = centavos_series(inventario_df[col])
+    # Tipos compactos (textos de pyarrow, categorías, int32) para lo que queda en memoria de la sesión
+    return aplicar_esquema(inventario_df, ESQUEMA_INVENTARIO)
+
+def cargar_ventas():
+    """Carga el historial completo de ventas en un AlmacenVentas (al abrir la sesión; después solo se le agregan ventas)."""
+    ventas_df = read_sheet_to_df(VENTAS_SHEET_NAME, VENTAS_COLS)
+    filas_copia = ventas_df.attrs.get('filas_copia', 0)
+    era = ventas_df.attrs.get('era')
+    # Las filas posteriores a la copia local son ventas en cola
+    en_cola = ventas_df['ID_VENTA'].iloc[filas_copia:].astype(str)
+    ventas_df = tipar_ventas(ventas_df)
+    # De la más antigua a la más reciente (la hoja puede tener ventas antiguas guardadas al revés)
+    ventas_df = ventas_df.sort_values('FECHA_HORA', kind='stable')
+    return AlmacenVentas(ventas_df, filas_copia, era, en_cola)
+
+def tipar_ventas(ventas_df):
+    """Convierte las columnas numéricas y la fecha de un DataFrame de ventas leído como texto."""
     if not ventas_df.empty:
         # Limpieza de tipos y manejo de valores numéricos para Ventas
-        for col in ['CANTIDAD_UNIDADES', 'PRECIO_VENTA_FINAL', 'COSTO_DEL_PRODUCTO_TOTAL', 'GASTOS_DIRECTOS_VIAJE', 'GANANCIA_NETA']:
-            ventas_df[col] = ventas_df[col].apply(parse_price)
-            if col == 'CANTIDAD_UNIDADES':
-                 ventas_df[col] = ventas_df[col].fillna(0).astype(int)
+        ventas_df['CANTIDAD_UNIDADES'] = parse_price_texto_series(ventas_df['CANTIDAD_UNIDADES']).fillna(0).astype(int)
+        # Importes en centavos enteros: los totales son exactos y se suman como enteros
+        for col in ['PRECIO_VENTA_FINAL', 'COSTO_DEL_PRODUCTO_TOTAL', 'GASTOS_DIRECTOS_VIAJE', 'GANANCIA_NETA']:
+            ventas_df[col] = centavos_series(ventas_df[col])
         
-        # Asegurar que la columna de fecha sea tipo string para evitar problemas de formato
-        if 'FECHA_HORA' in ventas_df.columns:
-            ventas_df['FECHA_HORA'] = ventas_df['FECHA_HORA'].astype(str)
-
-    return inventario_df, ventas_df
-
-def save_data(inventario_df, ventas_df):
-    """Guarda ambos DataFrames en Google Sheets."""
-    # Invalidamos el cache para que la próxima lectura sea fresca
-    st.cache_data.clear()
-    write_df_to_sheet(INVENTARIO_SHEET_NAME, inventario_df, INVENTARIO_COLS) 
-    write_df_to_sheet(VENTAS_SHEET_NAME, ventas_df, VENTAS_COLS)
-    st.session_state['data_saved'] = datetime.now().strftime('%H:%M:%S')
+        # La fecha se convierte una sola vez, en bloque y con el formato fijo con que la app la escribe
+        texto = ventas_df['FECHA_HORA']
+        fechas = pd.to_datetime(texto, format=FORMATO_FECHA_HORA, errors='coerce')
+        # Fechas cargadas a mano en otro formato (ej: '1/2/2025 10:00:00'): solo esas se interpretan una a una
+        otras = fechas.isna() & texto.notna() & (texto.astype(str).str.strip() != '')
+        if otras.any():
+            fechas[otras] = pd.to_datetime(texto[otras], format='mixed', dayfirst=True, errors='coerce')
+        ventas_df['FECHA_HORA'] = fechas
+    return ventas_df
 
 def generar_sku(nombre):
     """Genera un SKU intuitivo (ej: Lámpara LED 12V -> LED12V-XXX)"""
@@ -195,36 +1979,41 @@ def generar_sku(nombre):
     return f"{sku_base}-{sufijo}"
 
 
-def registrar_venta(inventario_df, ventas_df, nombre_producto, cantidad, tipo_cliente, precio_final, gastos_viaje, vendedor):
+def registrar_venta(inventario_df, ventas, nombre_producto, cantidad, tipo_cliente, precio_final, gastos_viaje, vendedor):
     """
     Registra una transacción de venta, calcula la ganancia y actualiza el stock.
+    precio_final y gastos_viaje van en centavos enteros (ver a_centavos).
+    Devuelve la fila de la venta registrada (o None si no se pudo registrar).
     """
     
-    producto_index = inventario_df[inventario_df['NOMBRE_PRODUCTO'] == nombre_producto].index 
+    try:
+        idx = ubicar_producto(inventario_df, 'NOMBRE_PRODUCTO', nombre_producto)
+    except ValueError as e:
+        st.error(f"❌ ERROR: {e}")
+        return inventario_df, ventas, None
     
-    if producto_index.empty:
+    if idx is None:
         st.error(f"❌ ERROR: Producto '{nombre_producto}' no encontrado.")
-        return inventario_df, ventas_df, False
+        return inventario_df, ventas, None
         
-    idx = producto_index[0]
     producto = inventario_df.loc[idx].copy()
         
     cantidad_actual = producto['CANTIDAD_ACTUAL']
     
     if cantidad_actual < cantidad:
         st.warning(f"❌ Stock insuficiente. Solo quedan {cantidad_actual} unidades.")
-        return inventario_df, ventas_df, False
+        return inventario_df, ventas, None
 
-    costo_unitario = parse_price(producto['COSTO_UNITARIO'])
+    costo_unitario = int(producto['COSTO_UNITARIO']) # centavos
     costo_total_venta = costo_unitario * cantidad
     
     codigo_sku = producto['CODIGO_SKU'] 
     
     ganancia_neta = precio_final - costo_total_venta - gastos_viaje
 
-    registro_venta = pd.Series({
+    venta = {
         'ID_VENTA': str(uuid.uuid4())[:8],
-        'FECHA_HORA': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'FECHA_HORA': datetime.now().strftime(FORMATO_FECHA_HORA),
         'CODIGO_SKU_VENDIDO': codigo_sku, 
         'NOMBRE_PRODUCTO_VENDIDO': nombre_producto,
         'CANTIDAD_UNIDADES': cantidad,
@@ -234,20 +2023,59 @@ def registrar_venta(inventario_df, ventas_df, nombre_producto, cantidad, tipo_cl
         'GASTOS_DIRECTOS_VIAJE': gastos_viaje,
         'GANANCIA_NETA': ganancia_neta,
         'VENDEDOR_REGISTRA': vendedor
-    }).to_frame().T
-    
-    ventas_df = pd.concat([registro_venta, ventas_df], ignore_index=True)
+    }
+    # Se agrega al final del almacén: no copia el historial y conserva los tipos numéricos
+    ventas.agregar(venta)
     
     inventario_df.loc[idx, 'CANTIDAD_ACTUAL'] -= cantidad
     
     st.success(f"✅ Venta de {cantidad} x '{nombre_producto}' registrada. Stock actualizado.")
-    st.markdown(f"**💰 Ganancia Neta (oculta para Martín):** **${ganancia_neta:,.2f}**")
+    st.markdown(f"**💰 Ganancia Neta (oculta para Martín):** **{formato_dinero(ganancia_neta)}**")
     
-    return inventario_df, ventas_df, True
+    return inventario_df, ventas, venta
+
+def validar_ticket(inventario_df, lineas):
+    """Verifica el stock de todas las líneas de un ticket contra el mismo inventario. Devuelve la lista de errores."""
+    pedidos = {}
+    for linea in lineas:
+        pedidos[linea['producto']] = pedidos.get(linea['producto'], 0) + linea['cantidad']
+
+    errores = []
+    for producto, cantidad in pedidos.items():
+        try:
+            etiqueta = ubicar_producto(inventario_df, 'NOMBRE_PRODUCTO', producto)
+        except ValueError as e:
+            errores.append(str(e))
+            continue
+        if etiqueta is None:
+            errores.append(f"Producto '{producto}' no encontrado.")
+        elif inventario_df.loc[etiqueta, 'CANTIDAD_ACTUAL'] < cantidad:
+            errores.append(f"Stock insuficiente de '{producto}': se piden {cantidad} y quedan {inventario_df.loc[etiqueta, 'CANTIDAD_ACTUAL']}.")
+    return errores
+
+def registrar_ticket(inventario_df, ventas, lineas):
+    """
+    Registra todas las líneas de un ticket si hay stock para todas (si falta para alguna, no registra ninguna).
+    Devuelve las ventas registradas (o None si el ticket no pasó la validación).
+    """
+    errores = validar_ticket(inventario_df, lineas)
+    if errores:
+        for error in errores:
+            st.error(f"❌ {error}")
+        return inventario_df, ventas, None
+
+    registradas = []
+    for linea in lineas:
+        inventario_df, ventas, venta = registrar_venta(
+            inventario_df, ventas, linea['producto'], linea['cantidad'], linea['tipo_cliente'],
+            linea['precio_final'], linea['gastos_viaje'], linea['vendedor']
+        )
+        registradas.append(venta)
+    return inventario_df, ventas, registradas
 
 # --- INTERFAZ DE USUARIO (Streamlit) ---
 
-def mostrar_registro_ventas(inventario_df, ventas_df):
+def mostrar_registro_ventas(inventario_df, ventas):
     """Muestra la interfaz para registrar una nueva venta con búsqueda inteligente."""
     st.header("💰 Registro Rápido de Venta")
     st.markdown("---")
@@ -257,12 +2085,14 @@ def mostrar_registro_ventas(inventario_df, ventas_df):
     producto_seleccionado = 'Seleccione un Producto'
 
     if len(producto_busqueda) >= 3:
-        search_cleaned = clean_input(producto_busqueda)
-        
-        sugerencias = inventario_df[
-            inventario_df['NOMBRE_PRODUCTO'].astype(str).apply(clean_input).str.contains(search_cleaned, na=False) |
-            inventario_df['CODIGO_SKU'].astype(str).apply(clean_input).str.contains(search_cleaned, na=False)
-        ]['NOMBRE_PRODUCTO'].tolist()
+        # El índice se arma una vez por versión del inventario (no por venta); cada tecla solo cruza trigramas
+        indice = obtener_indice_busqueda(inventario_df)
+        posiciones, total, aproximado = buscar_productos(indice, producto_busqueda)
+        sugerencias = [indice['nombres'][i] for i in posiciones]
+        if aproximado and sugerencias:
+            st.caption("No hay coincidencias exactas. Productos parecidos:")
+        elif total > len(posiciones):
+            st.caption(f"Mostrando las {len(posiciones)} mejores de {total} coincidencias. Escriba más letras para afinar.")
         
         if sugerencias:
             producto_seleccionado = st.selectbox("Selecciona el producto:", ['Seleccione un Producto'] + sugerencias)
@@ -276,14 +2106,17 @@ def mostrar_registro_ventas(inventario_df, ventas_df):
     col1, col2 = st.columns(2)
     
     producto_encontrado = None
-    precio_sugerido_display = 0.0
+    precio_sugerido_display = 0 # centavos
     stock = 0
     sku = ""
 
     if producto_seleccionado != 'Seleccione un Producto':
-        producto_encontrado = inventario_df[inventario_df['NOMBRE_PRODUCTO'] == producto_seleccionado].iloc[0]
-        stock = producto_encontrado['CANTIDAD_ACTUAL']
-        sku = producto_encontrado['CODIGO_SKU']
+        try:
+            producto_encontrado = inventario_df.loc[ubicar_producto(inventario_df, 'NOMBRE_PRODUCTO', producto_seleccionado)]
+            stock = producto_encontrado['CANTIDAD_ACTUAL']
+            sku = producto_encontrado['CODIGO_SKU']
+        except ValueError as e:
+            st.error(f"❌ ERROR: {e}")
 
 
     with col1:
@@ -293,40 +2126,79 @@ def mostrar_registro_ventas(inventario_df, ventas_df):
         
         if producto_encontrado is not None:
             if tipo_cliente == 'Mayorista':
-                precio_sugerido_display = parse_price(producto_encontrado['PRECIO_BASE'])
+                precio_sugerido_display = int(producto_encontrado['PRECIO_BASE'])
             else: 
-                precio_sugerido_display = parse_price(producto_encontrado['PRECIO_PUBLICO'])
+                precio_sugerido_display = int(producto_encontrado['PRECIO_PUBLICO'])
                 
-        precio_final_str = st.text_input("4. Precio Final $", value=f"{precio_sugerido_display:,.0f}" if precio_sugerido_display else "0")
-        precio_final = parse_price(precio_final_str)
+        precio_final_str = st.text_input("4. Precio Final $", value=f"{precio_sugerido_display / 100:,.0f}" if precio_sugerido_display else "0")
+        precio_final = a_centavos(precio_final_str)
 
     with col2:
         gastos_viaje_str = st.text_input("5. Gastos de la Venta $", value="0")
-        gastos_viaje = parse_price(gastos_viaje_str)
+        gastos_viaje = a_centavos(gastos_viaje_str)
         
         vendedor = st.selectbox("6. Registrado por", ['Martin', 'Amanda', 'Otro']) 
         
     if producto_seleccionado != 'Seleccione un Producto':
-        st.info(f"SKU: **{sku}** | Stock: **{stock}** | Sugerido ({tipo_cliente}): **${precio_sugerido_display:,.2f}**")
+        st.info(f"SKU: **{sku}** | Stock: **{stock}** | Sugerido ({tipo_cliente}): **{formato_dinero(precio_sugerido_display)}**")
     
     st.markdown("---")
+
+    if producto_seleccionado in ('Seleccione un Producto', ''):
+        error_linea = "Por favor, seleccione un producto o complete la búsqueda."
+    elif precio_final <= 0:
+        error_linea = "El Precio Final debe ser mayor que cero."
+    else:
+        error_linea = None
     
-    if st.button("REGISTRAR VENTA y ACTUALIZAR INVENTARIO", type="primary"):
-        if producto_seleccionado not in ('Seleccione un Producto', '') and precio_final > 0:
-            # Recargamos para evitar conflictos si alguien más cambió la hoja
-            st.session_state['inventario_df'], st.session_state['ventas_df'] = load_data() 
-            
-            st.session_state['inventario_df'], st.session_state['ventas_df'], exito = registrar_venta(
-                st.session_state['inventario_df'], st.session_state['ventas_df'], 
-                producto_seleccionado, cantidad, tipo_cliente, precio_final, gastos_viaje, vendedor
+    boton_venta, boton_ticket = st.columns(2)
+
+    if boton_venta.button("REGISTRAR VENTA y ACTUALIZAR INVENTARIO", type="primary"):
+        if error_linea is None:
+            # Se registra sobre el inventario local más lo pendiente de envío y se agrega al historial de la sesión
+            # (sin recargarlo: el costo de una venta no crece con el historial); la hoja se actualiza en segundo plano
+            inventario_df = cargar_inventario()
+            inventario_df, ventas, venta = registrar_venta(
+                inventario_df, ventas, producto_seleccionado, cantidad, tipo_cliente, precio_final, gastos_viaje, vendedor
             )
-            if exito:
-                save_data(st.session_state['inventario_df'], st.session_state['ventas_df'])
+            if venta is not None:
+                encolar_ventas(inventario_df, [venta])
+                st.session_state['inventario_df'], st.session_state['ventas'] = inventario_df, ventas
                 st.rerun() 
-        elif producto_seleccionado in ('Seleccione un Producto', ''):
-            st.error("Por favor, seleccione un producto o complete la búsqueda.")
-        elif precio_final <= 0:
-             st.error("El Precio Final debe ser mayor que cero.")
+        else:
+            st.error(error_linea)
+
+    if boton_ticket.button("➕ AGREGAR AL TICKET"):
+        if error_linea is None:
+            st.session_state.setdefault('carrito', []).append({
+                'producto': producto_seleccionado, 'cantidad': cantidad, 'tipo_cliente': tipo_cliente,
+                'precio_final': precio_final, 'gastos_viaje': gastos_viaje, 'vendedor': vendedor
+            })
+        else:
+            st.error(error_linea)
+
+    carrito = st.session_state.get('carrito', [])
+    if carrito:
+        st.markdown("---")
+        st.subheader(f"🧾 Ticket en curso ({len(carrito)} líneas)")
+        ticket_display = pd.DataFrame(carrito)
+        for col in ['precio_final', 'gastos_viaje']:
+            ticket_display[col] = ticket_display[col].map(formato_dinero)
+        st.dataframe(ticket_display.rename(columns=str.upper), use_container_width=True)
+
+        boton_registrar, boton_vaciar = st.columns(2)
+        if boton_registrar.button("REGISTRAR TICKET COMPLETO", type="primary"):
+            # Una sola recarga del inventario, validación de todas las líneas contra ese inventario y un solo envío
+            inventario_df = cargar_inventario()
+            inventario_df, ventas, registradas = registrar_ticket(inventario_df, ventas, carrito)
+            if registradas is not None:
+                encolar_ventas(inventario_df, registradas)
+                st.session_state['inventario_df'], st.session_state['ventas'] = inventario_df, ventas
+                st.session_state['carrito'] = []
+                st.rerun()
+        if boton_vaciar.button("Vaciar ticket"):
+            st.session_state['carrito'] = []
+            st.rerun()
 
 def eliminar_producto(inventario_df, nombre_producto):
     """Elimina un producto del inventario."""
@@ -344,8 +2216,9 @@ def mostrar_inventario(df):
     
     if st.button("ELIMINAR PRODUCTO", type="secondary"):
         if producto_a_eliminar != 'Seleccione un Producto para eliminar':
-            st.session_state['inventario_df'] = eliminar_producto(st.session_state['inventario_df'], producto_a_eliminar)
-            save_data(st.session_state['inventario_df'], st.session_state['ventas_df'])
+            # Se envía en segundo plano sobre la última versión de la hoja (si otro vendedor escribe antes, se reaplica)
+            encolar('eliminar_producto', {'nombre': str(producto_a_eliminar)})
+            st.session_state['inventario_df'] = cargar_inventario()
             st.success(f"🗑️ Producto '{producto_a_eliminar}' eliminado del inventario.")
             st.rerun()
         else:
@@ -356,20 +2229,27 @@ def mostrar_inventario(df):
     st.subheader("🔎 Inventario Actual")
     search_term = st.text_input("Buscar producto por nombre o SKU:", key='inv_search')
     if search_term:
-        search_term_lower = clean_input(search_term)
-        df_filtered = df[
-            df['NOMBRE_PRODUCTO'].astype(str).apply(clean_input).str.contains(search_term_lower, na=False) |
-            df['CODIGO_SKU'].astype(str).apply(clean_input).str.contains(search_term_lower, na=False)
-        ]
+        # Mismo índice de búsqueda que el Registro Rápido (se arma una vez por versión del inventario)
+        posiciones, total, aproximado = buscar_productos(obtener_indice_busqueda(df), search_term, LIMITE_RESULTADOS_INVENTARIO)
+        df_filtered = df.iloc[posiciones]
+        if aproximado and posiciones:
+            st.caption("No hay coincidencias exactas. Se muestran los productos más parecidos.")
+        elif total > len(posiciones):
+            st.caption(f"Mostrando los {len(posiciones)} más relevantes de {total} productos encontrados.")
     else:
         df_filtered = df
 
     df_display = df_filtered.copy()
     for col in ['COSTO_UNITARIO', 'PRECIO_BASE', 'PRECIO_PUBLICO']:
-        df_display[col] = df_display[col].apply(lambda x: f"${x:,.2f}")
+        df_display[col] = df_display[col].map(formato_dinero)
     
     st.dataframe(df_display, use_container_width=True, height=300)
     st.markdown(f"**Total de Productos en Catálogo: {len(df)}**")
+
+    repetidos = obtener_indice_inventario(df)['duplicados']
+    for col in COLUMNAS_INDEXADAS:
+        if repetidos[col]:
+            st.warning(f"⚠️ {col} repetido en el catálogo: {', '.join(sorted(repetidos[col])[:10])}. Las ventas de esos productos quedan bloqueadas hasta corregirlo.")
     
 def mostrar_carga_masiva():
     """Interfaz para cargar un archivo CSV de inventario."""
@@ -402,25 +2282,69 @@ def mostrar_carga_masiva():
             
             df_a_cargar = df_a_cargar[INVENTARIO_COLS]
             
-            st.session_state['inventario_df'], st.session_state['ventas_df'] = load_data()
-            
-            inventario_df = pd.concat([st.session_state['inventario_df'], df_a_cargar], ignore_index=True)
-            inventario_df.drop_duplicates(subset=['NOMBRE_PRODUCTO'], keep='last', inplace=True)
-            inventario_df.reset_index(drop=True, inplace=True)
-            
-            st.session_state['inventario_df'] = inventario_df
-            save_data(inventario_df, st.session_state['ventas_df'])
+            # Se envía en segundo plano sobre la última versión de la hoja (un nombre repetido reemplaza al anterior)
+            encolar('agregar_productos', {'filas': df_a_cargar.astype(str).values.tolist()})
+            st.session_state['inventario_df'] = cargar_inventario()
             
             st.success(f"🎉 ¡ÉXITO! {len(df_a_cargar)} productos cargados/actualizados. Revise los SKUs generados en el Inventario.")
             
         except Exception as e:
             st.error(f"❌ Ocurrió un error al procesar el archivo. El formato podría ser incorrecto o la codificación: {e}")
 
+def mostrar_estado_cola():
+    """Muestra en el menú lateral los cambios que esperan envío y los que chocaron con el stock del servidor."""
+    cantidades = contar_pendientes()
+    estado = _escritor()
+    error_conexion = _estado_conexion()['error']
+    if error_conexion:
+        st.sidebar.warning("📴 Sin conexión con Google Sheets. Se trabaja con la última copia guardada en este equipo; las ventas quedan guardadas aquí y se envían solas al volver la conexión.")
+        st.sidebar.caption(f"Detalle: {error_conexion}")
+    if cantidades.get('pendiente'):
+        st.sidebar.info(f"⏳ Cambios pendientes de enviar: {cantidades['pendiente']}")
+        if estado['error']:
+            segundos = max(int(estado['reintento'] - time.time()), 0)
+            st.sidebar.caption(f"Último error: {estado['error']} (reintento en {segundos} s)")
+            if st.sidebar.button("Reintentar ahora"):
+                reintentar_envio()
+    else:
+        st.sidebar.caption("✅ Todos los cambios están guardados en Google Sheets.")
+
+    cache = _cache_local()
+    while cache['avisos']:
+        st.sidebar.warning(f"⚠️ {cache['avisos'].pop(0)}")
+
+    conflictos = leer_pendientes('conflicto')
+    if conflictos:
+        st.sidebar.error(f"❌ {len(conflictos)} venta(s) sin enviar por conflicto de stock.")
+        with st.sidebar.expander("Ver ventas en conflicto"):
+            for pendiente in conflictos:
+                productos = ', '.join(fila[VENTAS_COLS.index('NOMBRE_PRODUCTO_VENDIDO')] for fila in pendiente['carga']['filas'])
+                st.caption(f"{productos}: {pendiente['detalle']}")
+                reintentar, descartar = st.columns(2)
+                if reintentar.button("Reintentar", key=f"reintentar_{pendiente['id']}"):
+                    _actualizar_pendientes([pendiente['id']], estado='pendiente')
+                    reintentar_envio()
+                    st.cache_data.clear()
+                    st.rerun()
+                if descartar.button("Descartar", key=f"descartar_{pendiente['id']}"):
+                    borrar_pendientes([pendiente['id']])
+                    # La venta descartada ya estaba en el historial y el stock de la sesión: se vuelven a cargar
+                    st.session_state.pop('inventario_df', None)
+                    st.session_state.pop('ventas', None)
+                    st.rerun()
+
 # --- ESTRUCTURA PRINCIPAL DE LA APLICACIÓN ---
 def main():
     
+    # Cada ejecución le pasa la conexión al hilo que envía la cola de escritura (sin conexión, solo se encola)
+    spreadsheet = conectar_hoja()
+    if spreadsheet is not None:
+        iniciar_escritor(spreadsheet)
+
     if 'inventario_df' not in st.session_state:
-        st.session_state['inventario_df'], st.session_state['ventas_df'] = load_data()
+        st.session_state['inventario_df'] = cargar_inventario()
+    if 'ventas' not in st.session_state:
+        st.session_state['ventas'] = cargar_ventas()
     
     st.title("⚙️ App de Negocio: Inventario y Ganancia (FINAL ☁️)")
     
@@ -429,7 +2353,7 @@ def main():
     st.sidebar.markdown("---")
     
     if page == "Registro Rápido":
-        mostrar_registro_ventas(st.session_state['inventario_df'], st.session_state['ventas_df'])
+        mostrar_registro_ventas(st.session_state['inventario_df'], st.session_state['ventas'])
     
     elif page == "Carga Masiva":
         mostrar_carga_masiva()
@@ -442,22 +2366,55 @@ def main():
         st.markdown("---")
         st.markdown("**Ganancia Neta es el resultado de: Venta - Costo - Gastos**")
         
-        # Recargar datos antes de reportes para tener la información más actual
-        st.session_state['inventario_df'], st.session_state['ventas_df'] = load_data()
+        # Sin recargar el historial: solo se leen las ventas nuevas de la copia local y de la cola
+        ventas = st.session_state['ventas']
+        try:
+            if not ventas.sincronizar():
+                ventas = st.session_state['ventas'] = cargar_ventas()
+            totales_ventas = resumen_actual()
+        except Exception as e:
+            st.error(f"❌ ERROR al leer las ventas de la copia local. Detalle: {e}")
+            totales_ventas = {}
         
-        ventas_df_clean = st.session_state['ventas_df'].copy()
+        periodo = st.selectbox("Período", ['Hoy', 'Esta semana', 'Este mes', 'Todo'], index=3)
+        desde = inicio_periodo(periodo)
+        
+        # Mostramos primero las más recientes del período
+        ventas_df_clean = ventas.recientes(20, desde=desde)
         
         # Formatear para la visualización
-        ventas_df_clean['GANANCIA_NETA_DISPLAY'] = ventas_df_clean['GANANCIA_NETA'].apply(lambda x: f"${x:,.2f}")
-        ventas_df_clean['PRECIO_VENTA_FINAL_DISPLAY'] = ventas_df_clean['PRECIO_VENTA_FINAL'].apply(lambda x: f"${x:,.2f}")
+        # Los importes están en centavos: se formatean solo para mostrar
+        ventas_df_clean['GANANCIA_NETA_DISPLAY'] = ventas_df_clean['GANANCIA_NETA'].map(formato_dinero)
+        ventas_df_clean['PRECIO_VENTA_FINAL_DISPLAY'] = ventas_df_clean['PRECIO_VENTA_FINAL'].map(formato_dinero)
+        ventas_df_clean['GASTOS_DIRECTOS_VIAJE'] = ventas_df_clean['GASTOS_DIRECTOS_VIAJE'].map(formato_dinero)
+        
+        st.dataframe(ventas_df_clean[['FECHA_HORA', 'CODIGO_SKU_VENDIDO', 'NOMBRE_PRODUCTO_VENDIDO', 'TIPO_CLIENTE', 'PRECIO_VENTA_FINAL_DISPLAY', 'GASTOS_DIRECTOS_VIAJE', 'GANANCIA_NETA_DISPLAY']].rename(columns={'PRECIO_VENTA_FINAL_DISPLAY': 'PRECIO VENTA', 'GANANCIA_NETA_DISPLAY': 'GANANCIA NETA'}), use_container_width=True)
         
-        st.dataframe(ventas_df_clean[['FECHA_HORA', 'CODIGO_SKU_VENDIDO', 'NOMBRE_PRODUCTO_VENDIDO', 'TIPO_CLIENTE', 'PRECIO_VENTA_FINAL_DISPLAY', 'GASTOS_DIRECTOS_VIAJE', 'GANANCIA_NETA_DISPLAY']].head(20).rename(columns={'PRECIO_VENTA_FINAL_DISPLAY': 'PRECIO VENTA', 'GANANCIA_NETA_DISPLAY': 'GANANCIA NETA'}), use_container_width=True)
+        # Los totales salen del resumen por día x producto x vendedor x tipo de cliente, no de cada venta
+        resumen = tabla_resumen(totales_ventas, desde=desde)
+        total_ganancia = resumen['GANANCIA_NETA'].sum()
+        st.metric("GANANCIA NETA TOTAL (Acumulada)" if desde is None else f"GANANCIA NETA ({periodo})", formato_dinero(total_ganancia))
         
-        total_ganancia = ventas_df_clean['GANANCIA_NETA'].sum()
-        st.metric("GANANCIA NETA TOTAL (Acumulada)", f"${total_ganancia:,.2f}")
+        agrupaciones = {'Producto': 'NOMBRE_PRODUCTO_VENDIDO', 'Vendedor': 'VENDEDOR_REGISTRA', 'Tipo de Cliente': 'TIPO_CLIENTE', 'Día': 'DIA'}
+        agrupar_por = st.selectbox("Totales por", list(agrupaciones))
+        totales = resumen.groupby(agrupaciones[agrupar_por])[RESUMEN_TOTALES].sum().sort_values('GANANCIA_NETA', ascending=False)
+        for col in ['PRECIO_VENTA_FINAL', 'COSTO_DEL_PRODUCTO_TOTAL', 'GASTOS_DIRECTOS_VIAJE', 'GANANCIA_NETA']:
+            totales[col] = totales[col].map(formato_dinero)
+        st.dataframe(totales.rename(columns={'PRECIO_VENTA_FINAL': 'VENTA', 'COSTO_DEL_PRODUCTO_TOTAL': 'COSTO', 'GASTOS_DIRECTOS_VIAJE': 'GASTOS', 'GANANCIA_NETA': 'GANANCIA NETA'}), use_container_width=True)
+        st.caption(f"Memoria en uso: inventario {memoria_mb(st.session_state['inventario_df']):.2f} MB, ventas {ventas.memoria_mb():.2f} MB")
         
     st.sidebar.markdown("---")
-    st.sidebar.caption(f"Último Guardado: {st.session_state.get('data_saved', 'Nunca')}")
+    mostrar_estado_cola()
+    cache = _cache_local()
+    st.sidebar.caption(f"Último Guardado: {cache.get('ultimo_envio', 'Nunca')}")
+    for hoja, (enviadas, totales) in cache['envios'].items():
+        st.sidebar.caption(f"Celdas enviadas ({hoja}): {enviadas:,} de {totales:,}")
+    uso = uso_api()
+    st.sidebar.caption(
+        f"Llamadas a la API (último minuto): {uso['lectura']} lecturas de {CUOTA_POR_MINUTO['lectura']}, "
+        f"{uso['escritura']} escrituras de {CUOTA_POR_MINUTO['escritura']}"
+        + (f", {uso['rechazos']} rechazadas por cuota" if uso['rechazos'] else "")
+    )
 
 
 if __name__ == "__main__":
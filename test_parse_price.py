@@ -0,0 +1,70 @@
+"""
+Comparación de los conversores en bloque de precios con parse_price, celda por celda, sobre un corpus aleatorio.
+Correr con: python -m pytest -q test_parse_price.py
+"""
+import math
+import random
+
+import gspread
+import numpy as np
+import pandas as pd
+
+from app import parse_price, parse_price_series, parse_price_texto_series
+
+CANTIDAD_CORPUS = 50000
+CARACTERES = '0123456789.,-+eE _ab$'
+
+
+def _texto_aleatorio(rnd):
+    """Textos parecidos a lo que se carga a mano en la hoja: precios con separadores, basura y casos borde."""
+    tipo = rnd.random()
+    if tipo < 0.3:
+        # Precios con separador de miles y decimales (ej: '2.000,50', '1,200', '12.0')
+        entero = f"{rnd.randint(0, 10**7):,}".replace(',', rnd.choice(['.', ',', '']))
+        decimales = rnd.choice(['', f",{rnd.randint(0, 99):02d}", f".{rnd.randint(0, 9)}"])
+        return rnd.choice(['', '-', ' ']) + entero + decimales
+    if tipo < 0.5:
+        return ''.join(rnd.choice(CARACTERES) for _ in range(rnd.randint(0, 8)))
+    if tipo < 0.6:
+        return rnd.choice(['', ' ', 'nan', 'NaN', 'inf', '-inf', '1e5', '1e400', '.5', '5.', '1_000', '0x10', '١٢', 'N/A'])
+    return str(rnd.choice([rnd.randint(-10**6, 10**6), round(rnd.uniform(-1e6, 1e6), rnd.randint(0, 4))]))
+
+
+def _corpus(semilla):
+    rnd = random.Random(semilla)
+    return [_texto_aleatorio(rnd) for _ in range(CANTIDAD_CORPUS)]
+
+
+def _iguales(obtenido, esperado):
+    """Compara valor a valor; NaN es igual a NaN (parse_price('nan') devuelve NaN)."""
+    assert len(obtenido) == len(esperado)
+    distintos = [
+        (i, a, b) for i, (a, b) in enumerate(zip(obtenido, esperado))
+        if not (a == b or (math.isnan(a) and math.isnan(b)))
+    ]
+    assert not distintos, distintos[:10]
+
+
+def test_parse_price_series_textos():
+    textos = _corpus(1)
+    _iguales(parse_price_series(pd.Series(textos, dtype=object)).tolist(), [parse_price(t) for t in textos])
+
+
+def test_parse_price_series_mezcla_de_tipos():
+    rnd = random.Random(2)
+    valores = _corpus(3)[:10000] + [rnd.randint(-10**6, 10**6) for _ in range(5000)] + [rnd.uniform(-1e6, 1e6) for _ in range(5000)]
+    valores += [None, np.nan, pd.NA, True, [1], float('inf')]
+    rnd.shuffle(valores)
+    _iguales(parse_price_series(pd.Series(valores, dtype=object)).tolist(), [parse_price(v) for v in valores])
+
+
+def test_parse_price_series_columna_numerica():
+    serie = pd.Series(np.random.default_rng(4).uniform(-1e6, 1e6, 1000))
+    _iguales(parse_price_series(serie).tolist(), [parse_price(v) for v in serie])
+
+
+def test_parse_price_texto_series_igual_a_get_all_records():
+    # Antes: get_all_records pasaba cada celda por numericise y después load_data aplicaba parse_price
+    textos = _corpus(5)
+    esperado = [parse_price(gspread.utils.numericise(t)) for t in textos]
+    _iguales(parse_price_texto_series(pd.Series(textos, dtype=object)).tolist(), esperado)
@@ -0,0 +1,154 @@
+"""
+Comportamiento del resumen de ventas guardado en la copia local (resumen_actual, guardar_resumen):
+crece solo con las filas nuevas, se rehace cuando la copia se reemplaza y no cuenta dos veces las ventas en cola.
+Correr con: python -m pytest -q test_resumen_ventas.py
+"""
+import pytest
+import streamlit as st
+
+import app
+from app import VENTAS_COLS, VENTAS_SHEET_NAME
+
+
+def _venta(id_venta, producto='Cable USB', dia='2025-01-01', unidades=1, precio='400.0', ganancia='200.0'):
+    """Fila de Ventas como texto, en el orden de VENTAS_COLS."""
+    valores = {
+        'ID_VENTA': id_venta, 'FECHA_HORA': f'{dia} 10:00:00', 'CODIGO_SKU_VENDIDO': 'CAB-XYZ',
+        'NOMBRE_PRODUCTO_VENDIDO': producto, 'CANTIDAD_UNIDADES': str(unidades), 'TIPO_CLIENTE': 'Minorista',
+        'PRECIO_VENTA_FINAL': precio, 'COSTO_DEL_PRODUCTO_TOTAL': '200.0', 'GASTOS_DIRECTOS_VIAJE': '0.0',
+        'GANANCIA_NETA': ganancia, 'VENDEDOR_REGISTRA': 'Martin'
+    }
+    return [valores[c] for c in VENTAS_COLS]
+
+
+def _esperado(filas):
+    """Resumen contado a mano, fila por fila (montos en centavos)."""
+    resumen = {}
+    col = {c: VENTAS_COLS.index(c) for c in VENTAS_COLS}
+    for fila in filas:
+        clave = (fila[col['FECHA_HORA']][:10], fila[col['NOMBRE_PRODUCTO_VENDIDO']], fila[col['VENDEDOR_REGISTRA']], fila[col['TIPO_CLIENTE']])
+        valores = [1, int(fila[col['CANTIDAD_UNIDADES']])] + [
+            round(float(fila[col[c]]) * 100) for c in app.RESUMEN_TOTALES[2:]
+        ]
+        actuales = resumen.setdefault(clave, [0] * len(valores))
+        for i, valor in enumerate(valores):
+            actuales[i] += valor
+    return resumen
+
+
+@pytest.fixture
+def agrupadas(tmp_path, monkeypatch):
+    """Copia local vacía en un directorio temporal, sin conexión; devuelve cuántas filas agrupó cada llamada."""
+    monkeypatch.setattr(app, 'CACHE_LOCAL_PATH', str(tmp_path / 'cache_local.sqlite'))
+    monkeypatch.setattr(app, 'conectar_hoja', lambda: None)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    llamadas = []
+    agrupar_ventas = app.agrupar_ventas
+
+    def contar(ventas_df):
+        llamadas.append(len(ventas_df))
+        return agrupar_ventas(ventas_df)
+
+    monkeypatch.setattr(app, 'agrupar_ventas', contar)
+    yield llamadas
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+def test_resumen_crece_solo_con_las_filas_nuevas(agrupadas):
+    filas = [_venta('v1'), _venta('v2', 'Lámpara LED 12V', precio='1500.5', ganancia='500.5')]
+    app.guardar_snapshot(VENTAS_SHEET_NAME, [VENTAS_COLS] + filas)
+
+    assert app.resumen_actual() == _esperado(filas)
+    assert agrupadas == [2, 0] # La copia entera (primera vez) y la cola vacía
+    guardado = app.leer_resumen()
+    assert (guardado['filas'], guardado['ultimo_id'], guardado['totales']) == (2, 'v2', _esperado(filas))
+
+    # Filas agregadas al final de la copia: solo se agrupan esas
+    agrupadas.clear()
+    filas.append(_venta('v3', dia='2025-01-02', unidades=3))
+    app.agregar_filas_snapshot(VENTAS_SHEET_NAME, filas[-1:])
+    assert app.resumen_actual() == _esperado(filas)
+    assert agrupadas == [1, 0]
+
+    # Una copia nueva del servidor que solo creció al final (ventas de otro vendedor) también sigue el resumen
+    agrupadas.clear()
+    filas.append(_venta('v4', dia='2025-01-02'))
+    era = app.era_resumen()
+    app.guardar_snapshot(VENTAS_SHEET_NAME, [VENTAS_COLS] + filas)
+    assert app.era_resumen() == era
+    assert app.resumen_actual() == _esperado(filas)
+    assert agrupadas == [1, 0]
+
+    # Sin cambios no se agrupa nada de la copia
+    agrupadas.clear()
+    assert app.resumen_actual() == _esperado(filas)
+    assert agrupadas == [0]
+    assert app.leer_resumen()['filas'] == 4
+
+
+def test_resumen_se_rehace_cuando_la_copia_se_reemplaza(agrupadas):
+    filas = [_venta('v1'), _venta('v2'), _venta('v3', dia='2025-01-02')]
+    app.guardar_snapshot(VENTAS_SHEET_NAME, [VENTAS_COLS] + filas)
+    app.resumen_actual()
+    era = app.era_resumen()
+
+    # Una venta corregida en el servidor: lo ya sumado deja de valer
+    agrupadas.clear()
+    filas[0] = _venta('v1', 'Pila', precio='10.0', ganancia='5.0')
+    app.guardar_snapshot(VENTAS_SHEET_NAME, [VENTAS_COLS] + filas)
+    assert app.era_resumen() == era + 1
+    assert app.leer_resumen()['totales'] == {}
+    assert app.resumen_actual() == _esperado(filas)
+    assert agrupadas == [3, 0]
+    guardado = app.leer_resumen()
+    assert (guardado['era'], guardado['filas'], guardado['ultimo_id']) == (era + 1, 3, 'v3')
+
+    # Una celda editada en la copia también lo invalida
+    agrupadas.clear()
+    j = VENTAS_COLS.index('GANANCIA_NETA')
+    app.actualizar_celda_snapshot(VENTAS_SHEET_NAME, 2, j, '0.0')
+    filas[1][j] = '0.0'
+    assert app.era_resumen() == era + 2
+    assert app.resumen_actual() == _esperado(filas)
+    assert agrupadas == [3, 0]
+
+
+def test_resumen_no_cuenta_dos_veces_la_cola(agrupadas):
+    filas = [_venta('v1'), _venta('v2')]
+    app.guardar_snapshot(VENTAS_SHEET_NAME, [VENTAS_COLS] + filas)
+    app.resumen_actual()
+
+    # Las ventas en cola se suman al resumen pero no se guardan
+    ticket = [_venta('v3', 'Lámpara LED 12V'), _venta('v4')]
+    app.encolar('ventas', {'filas': ticket, 'descuentos': {}})
+    assert app.resumen_actual() == _esperado(filas + ticket)
+    guardado = app.leer_resumen()
+    assert (guardado['filas'], guardado['ultimo_id'], guardado['totales']) == (2, 'v2', _esperado(filas))
+
+    # Enviado el ticket, sus filas pasan de la cola a la copia y se cuentan una sola vez
+    app.agregar_filas_snapshot(VENTAS_SHEET_NAME, ticket)
+    app.borrar_pendientes([p['id'] for p in app.leer_pendientes()])
+    agrupadas.clear()
+    assert app.resumen_actual() == _esperado(filas + ticket)
+    assert agrupadas == [2, 0]
+    assert app.leer_resumen()['totales'] == _esperado(filas + ticket)
+
+
+def test_guardar_resumen_rechaza_lecturas_viejas(agrupadas):
+    filas = [_venta('v1'), _venta('v2')]
+    app.guardar_snapshot(VENTAS_SHEET_NAME, [VENTAS_COLS] + filas)
+    app.resumen_actual()
+    era = app.era_resumen()
+    nuevos = _esperado([_venta('v3')])
+
+    # Otra sesión ya avanzó el resumen desde (0, None): sumar de nuevo esas filas las contaría dos veces
+    assert not app.guardar_resumen(era, (0, None), (3, 'v3'), nuevos)
+    # La copia se reemplazó después de leerla
+    assert not app.guardar_resumen(era - 1, (2, 'v2'), (3, 'v3'), nuevos)
+    assert app.leer_resumen()['totales'] == _esperado(filas)
+
+    assert app.guardar_resumen(era, (2, 'v2'), (3, 'v3'), nuevos)
+    guardado = app.leer_resumen()
+    assert (guardado['filas'], guardado['ultimo_id'], guardado['totales']) == (3, 'v3', _esperado(filas + [_venta('v3')]))
@@ -0,0 +1,120 @@
+"""
+Comportamiento del cálculo de cambios contra la copia del servidor (calcular_cambios) y de la aplicación
+de los cambios encolados sobre las filas de una hoja (aplicar_pendiente).
+Correr con: python -m pytest -q test_sincronizacion.py
+"""
+from app import INVENTARIO_COLS, VENTAS_COLS, aplicar_pendiente, calcular_cambios
+
+ENCABEZADO = ['ID_PRODUCTO', 'NOMBRE_PRODUCTO', 'CANTIDAD_ACTUAL']
+
+
+def _venta(id_venta, producto='Cable USB', unidades='1'):
+    """Fila de Ventas como la encola encolar_ventas (en el orden de VENTAS_COLS)."""
+    valores = {
+        'ID_VENTA': id_venta, 'FECHA_HORA': '2025-01-01 10:00:00', 'CODIGO_SKU_VENDIDO': 'CAB-XYZ',
+        'NOMBRE_PRODUCTO_VENDIDO': producto, 'CANTIDAD_UNIDADES': unidades, 'TIPO_CLIENTE': 'Minorista',
+        'PRECIO_VENTA_FINAL': '400.0', 'COSTO_DEL_PRODUCTO_TOTAL': '200.0', 'GASTOS_DIRECTOS_VIAJE': '0.0',
+        'GANANCIA_NETA': '200.0', 'VENDEDOR_REGISTRA': 'Martin'
+    }
+    return [valores[c] for c in VENTAS_COLS]
+
+
+def test_calcular_cambios_fila_modificada_y_agregadas():
+    previo = [ENCABEZADO, ['a', 'Lámpara', '10'], ['b', 'Cable', '3'], ['c', 'Pila', '7']]
+    nuevo = [ENCABEZADO, ['a', 'Lámpara', '10'], ['b', 'Cable USB', '2'], ['c', 'Pila', '7'], ['d', 'Foco', '1'], ['e', 'Enchufe', '4']]
+
+    rangos, celdas, resultado = calcular_cambios(previo, nuevo, 'ID_PRODUCTO')
+
+    # Solo las celdas de la fila cambiada (de la primera a la última modificada) y las filas nuevas al final
+    assert rangos == [
+        {'range': 'B3:C3', 'values': [['Cable USB', '2']]},
+        {'range': 'A5:C6', 'values': [['d', 'Foco', '1'], ['e', 'Enchufe', '4']]},
+    ]
+    assert celdas == 2 + 2 * 3
+    assert resultado == nuevo
+    assert previo[2] == ['b', 'Cable', '3'] # No modifica la copia recibida
+
+
+def test_calcular_cambios_sigue_la_fila_por_su_clave():
+    # La fila se ubica por la clave aunque los datos a guardar vengan en otro orden
+    previo = [ENCABEZADO, ['a', 'Lámpara', '10'], ['b', 'Cable', '3']]
+    nuevo = [ENCABEZADO, ['b', 'Cable', '3'], ['a', 'Lámpara', '9']]
+
+    rangos, celdas, resultado = calcular_cambios(previo, nuevo, 'ID_PRODUCTO')
+
+    assert rangos == [{'range': 'C2:C2', 'values': [['9']]}]
+    assert celdas == 1
+    assert resultado == [ENCABEZADO, ['a', 'Lámpara', '9'], ['b', 'Cable', '3']]
+
+
+def test_calcular_cambios_sin_cambios():
+    previo = [ENCABEZADO, ['a', 'Lámpara', '10']]
+    assert calcular_cambios(previo, [list(fila) for fila in previo], 'ID_PRODUCTO') == ([], 0, previo)
+
+
+def test_calcular_cambios_fila_eliminada_pide_reescribir():
+    previo = [ENCABEZADO, ['a', 'Lámpara', '10'], ['b', 'Cable', '3'], ['c', 'Pila', '7']]
+    nuevo = [ENCABEZADO, ['a', 'Lámpara', '10'], ['c', 'Pila', '7'], ['d', 'Foco', '1']]
+    assert calcular_cambios(previo, nuevo, 'ID_PRODUCTO') is None
+
+
+def test_calcular_cambios_casos_que_piden_reescribir():
+    previo = [ENCABEZADO, ['a', 'Lámpara', '10']]
+    # Sin copia previa
+    assert calcular_cambios(None, previo, 'ID_PRODUCTO') is None
+    assert calcular_cambios([], previo, 'ID_PRODUCTO') is None
+    # Encabezados distintos (otro orden de columnas)
+    assert calcular_cambios(previo, [['NOMBRE_PRODUCTO', 'ID_PRODUCTO', 'CANTIDAD_ACTUAL'], ['Lámpara', 'a', '10']], 'ID_PRODUCTO') is None
+    # Claves repetidas en la copia o en los datos nuevos
+    assert calcular_cambios(previo + [['a', 'Otra', '1']], previo, 'ID_PRODUCTO') is None
+    assert calcular_cambios(previo, previo + [['a', 'Otra', '1']], 'ID_PRODUCTO') is None
+
+
+def test_aplicar_pendiente_ticket_sobre_ventas_con_otro_orden_de_columnas():
+    encabezado = list(reversed(VENTAS_COLS))
+    datos = [encabezado, list(reversed(_venta('v1')))]
+    carga = {'filas': [_venta('v2'), _venta('v3', 'Lámpara LED 12V', '2')], 'descuentos': {'ffeeddcc': 1, 'a1b2c3d4': 2}}
+
+    resultado = aplicar_pendiente('Ventas', datos, 'ventas', carga)
+
+    # Las filas encoladas quedan al final, en el orden de columnas de la hoja
+    assert resultado == [encabezado, list(reversed(_venta('v1'))), list(reversed(_venta('v2'))), list(reversed(_venta('v3', 'Lámpara LED 12V', '2')))]
+    assert len(datos) == 2 # No modifica las filas recibidas
+
+
+def test_aplicar_pendiente_ticket_descuenta_stock_del_inventario():
+    datos = [
+        INVENTARIO_COLS,
+        ['a1b2c3d4', 'LAM12-ABC', 'Lámpara LED 12V', '10', '1000.5', '1500', '2000', 'A1'],
+        ['ffeeddcc', 'CAB-XYZ', 'Cable USB', '1,200', '200', '300', '400', 'B2'],
+        ['00000000', 'PIL-000', 'Pila', '5', '10', '15', '20', 'C3'],
+    ]
+    carga = {'filas': [_venta('v2'), _venta('v3', 'Lámpara LED 12V', '2')], 'descuentos': {'ffeeddcc': 1, 'a1b2c3d4': 2}}
+
+    resultado = aplicar_pendiente('Inventario', datos, 'ventas', carga)
+
+    j = INVENTARIO_COLS.index('CANTIDAD_ACTUAL')
+    assert [fila[j] for fila in resultado[1:]] == ['8', '1199', '5']
+    assert datos[1][j] == '10'
+
+    # Con el stock ya descontado en el servidor (y en la copia), el ticket no vuelve a descontar
+    assert aplicar_pendiente('Inventario', datos, 'ventas', dict(carga, stock_descontado=True)) == datos
+
+
+def test_aplicar_pendiente_cambios_de_inventario():
+    encabezado = ['NOMBRE_PRODUCTO', 'ID_PRODUCTO', 'CANTIDAD_ACTUAL']
+    datos = [encabezado, ['Lámpara', 'a', '10'], ['Cable', 'b', '3']]
+
+    eliminado = aplicar_pendiente('Inventario', datos, 'eliminar_producto', {'nombre': 'Lámpara'})
+    assert eliminado == [encabezado, ['Cable', 'b', '3']]
+
+    # Las filas llegan en el orden de la app; un nombre repetido queda con su última fila
+    nuevas = [
+        ['c', '', 'Pila', '4', '', '', '', ''],
+        ['d', '', 'Cable', '9', '', '', '', ''],
+    ]
+    agregado = aplicar_pendiente('Inventario', datos, 'agregar_productos', {'filas': nuevas})
+    assert agregado == [encabezado, ['Lámpara', 'a', '10'], ['Pila', 'c', '4'], ['Cable', 'd', '9']]
+
+    # Los cambios de inventario no tocan Ventas
+    assert aplicar_pendiente('Ventas', datos, 'eliminar_producto', {'nombre': 'Lámpara'}) == datos